@@ -561,3 +561,6 @@ VARIETAL_ABBREVIATIONS = {
     'carmenère': 'Carmenère',
     'carmenere': 'Carmenère'
 }
+
+# Dropped from normalized match keys, they carry no identity ("Château Margaux" ~ "Margaux")
+MATCH_STOP_WORDS = ['chateau', 'domaine', 'estate']
@@ -1,99 +1,271 @@
 import re
+from collections import OrderedDict
+from datetime import date
 
-from config.wine import reverse_country_patterns, reverse_country_regions
+from rapidfuzz.distance import Levenshtein
+
+import config.wine as wine
+from store.taxonomy import CompiledTaxonomy, get_taxonomy, span_key
+
+
+# edit distance -> letters a token needs for the fuzzy lookup to correct it that far, shorter
+# misreads are too ambiguous to correct
+FUZZY_MIN_LENGTH = {1: 6, 2: 9}
+
+# menu words close to a taxonomy term that are never misreads of it
+FUZZY_STOP_WORDS = frozenset({
+  'bottle', 'carafe', 'cellar', 'cellars', 'classic', 'creek', 'dessert', 'estate', 'family', 'heritage', 'house',
+  'organic', 'private', 'reserva', 'reserve', 'select', 'selection', 'single', 'sparkling', 'special', 'valley',
+  'vineyard', 'vineyards', 'vintage', 'winery',
+})
+
+
+# characters OCR reads one for the other, the only substitutions the fuzzy lookup corrects
+OCR_CONFUSIONS = frozenset(frozenset(pair) for pair in [
+  ('i', 'l'), ('i', '1'), ('l', '1'), ('i', 'j'), ('i', 't'), ('l', 't'), ('o', '0'), ('o', 'c'), ('c', 'e'),
+  ('e', 'o'), ('a', 'o'), ('n', 'h'), ('n', 'u'), ('u', 'v'), ('h', 'b'), ('s', '5'), ('b', '8'), ('g', '9'),
+  ('z', '2'), ('f', 't'), ('r', 'n'), ('e', 'é'), ('e', 'è'), ('e', 'ê'), ('a', 'à'), ('a', 'â'), ('o', 'ô'),
+  ('u', 'ü'), ('u', 'û'), ('i', 'î'), ('c', 'ç'),
+])
+
+# characters OCR drops or adds besides a letter next to its double ('chardonay')
+OCR_GAPS = frozenset(" -'.")
+
+
+def vintage_regex(current_year):
+  """
+  Regex of the vintages 1950 to current_year, optionally followed by 'vintage'/'v.' and 'wine'.
+  """
+  decade, year = divmod(current_year % 100, 10)
+  recent = [f'20[0-{decade - 1}]\\d'] if decade > 0 else []
+  recent.append(f'20{decade}[0-{year}]')
+
+  return re.compile(rf'\b(19[5-9]\d|{"|".join(recent)})(?:\s*(?:vintage|v\.?))?(?:\s*wine)?\b', re.IGNORECASE)
+
+
+def reading_lines(tokens, tolerance=0.5):
+  """
+  Indices of the tokens per line, lines top to bottom and tokens left to right.
+
+  A token joins the current line when its y is within tolerance times its height ('h', 0 when missing)
+  of the y of the line's first token.
+  """
+  lines = []
+  anchor = None
+  for i in sorted(range(len(tokens)), key=lambda i: (tokens[i].get('y', 0), tokens[i].get('x', 0))):
+    y = tokens[i].get('y', 0)
+    if anchor is None or y - anchor > tolerance * tokens[i].get('h', 0):
+      lines.append([])
+      anchor = y
+    lines[-1].append(i)
+
+  return [sorted(line, key=lambda i: tokens[i].get('x', 0)) for line in lines]
+
+
+def ocr_misread(text, term):
+  """
+  Whether text is term as OCR misreads it: confusable characters read one for the other, and doubled
+  letters or punctuation dropped or added.
+  """
+  for tag, source, destination in Levenshtein.editops(text, term):
+    if tag == 'replace':
+      if frozenset((text[source], term[destination])) not in OCR_CONFUSIONS:
+        return False
+    else:
+      word, position = (text, source) if tag == 'delete' else (term, destination)
+      char = word[position]
+      if char not in OCR_GAPS and char not in word[max(position - 1, 0):position] + word[position + 1:position + 2]:
+        return False
+  return True
 
 
 class MenuTokenEnrichor:
-  def __init__(self, red_varietals: list[str], white_varietals: list[str], varietal_abbreviations: dict[str, str], countries):
-    self.red_varietals = [v.lower() for v in red_varietals]
-    self.white_varietals = [v.lower() for v in white_varietals] 
-    self.varietal_abbreviations = {k.lower(): v.lower() for k, v in varietal_abbreviations.items()}
-    self.countries = [c.lower() for c in countries.keys()]
-    self.country_regions = reverse_country_regions(countries)
-    self.country_patterns = reverse_country_patterns(countries)
+  def __init__(self, red_varietals: list[str] = None, white_varietals: list[str] = None,
+               varietal_abbreviations: dict[str, str] = None, countries=None, memo_size=4096, current_year=None,
+               fuzzy_distance=2, fuzzy_confidence=0.8):
+    """
+    Args:
+        red_varietals, white_varietals, varietal_abbreviations, countries: taxonomy as in config/wine.py,
+            whose settings are used for the ones left out
+        memo_size: normalized token texts whose classification is remembered (least recently used are dropped)
+        current_year: latest vintage recognized, this year by default
+        fuzzy_distance: largest edit distance of a misread term (0 disables the fuzzy lookup), a token also
+            needs FUZZY_MIN_LENGTH letters for it and must not be one of FUZZY_STOP_WORDS
+        fuzzy_confidence: tokens read with this OCR 'confidence' or more are never corrected
+    """
+    self.taxonomy_config = (red_varietals, white_varietals, varietal_abbreviations, countries)
+    self._taxonomy = None
     self.price_regex = re.compile(r'(?:[\$€£]?\s*)?(\d+(?:[.,]\d{1,2})?)\s*(?:[\$€£])?', re.IGNORECASE)
+    self.vintage_regex = vintage_regex(current_year or date.today().year)
+    self.fuzzy_distance = fuzzy_distance
+    self.fuzzy_confidence = fuzzy_confidence
 
+    self.memo_size = memo_size
+    self.memo = OrderedDict()
+    self.stats = {'tokens': 0, 'memo_hits': 0, 'memo_misses': 0, 'spans': 0}
 
+  @property
+  def taxonomy(self):
+    """
+    Compiled taxonomy, built on first use.
+    """
+    if self._taxonomy is None:
+      defaults = (wine.RED_VARIETALS, wine.WHITE_VARIETALS, wine.VARIETAL_ABBREVIATIONS, wine.COUNTRIES)
+      values = [default if value is None else value for value, default in zip(self.taxonomy_config, defaults)]
 
-    # red_sorted = sorted(self.red_varietals, key=len, reverse=True)
-    # white_sorted = sorted(self.white_varietals, key=len, reverse=True)
-    # regions_sorted = sorted(self.country_regions.keys(), key=len, reverse=True)
+      # the config/wine.py taxonomy itself is compiled once per process and cached on disk
+      if all(value is default for value, default in zip(values, defaults)):
+        self._taxonomy = get_taxonomy()
+      else:
+        self._taxonomy = CompiledTaxonomy(*values)
+    return self._taxonomy
 
-    # self.red_regex = re.compile(r'\b(' + '|'.join(re.escape(v) for v in red_sorted) + r')\b', re.IGNORECASE)
-    # self.white_regex = re.compile(r'\b(' + '|'.join(re.escape(v) for v in white_sorted) + r')\b', re.IGNORECASE)
-    # self.region_regex = re.compile(r'\b(' + '|'.join(re.escape(r) for r in regions_sorted) + r')\b', re.IGNORECASE)
+  def enrich_token(self, token):
+    """
+    Add the classification of a token ('is_region', 'is_vintage', ... and the normalized 'text') to it.
 
+    A token matching no term exactly, read with a low 'confidence' (or none), is classified as the nearest
+    term it is an OCR misread of (ocr_misread) within the fuzzy distance: its 'text' is kept as read, the
+    term goes to 'term' and the edit distance to 'edit_distance'.
+    """
+    updates = self._lookup(token['text'].strip().lower())
+    if 'term' in updates and token.get('confidence', 0) >= self.fuzzy_confidence:
+      return token
 
-  def enrich_token(self, token):
-    text = token['text'].strip().lower()
+    token.update(updates)
+    return token
+
+  def enrich_tokens(self, tokens, spans=True, line_tolerance=0.5):
+    """
+    Enrich the tokens of a menu, repeated texts are classified once.
+
+    Args:
+        tokens: tokens of a menu, with their 'text' and 'x', 'y' (and height 'h') positions
+        spans: also tag the terms split over several tokens of a line (tag_spans): the leftmost token of a
+            span gets the term's classification and text, the others its classification and
+            'span_continuation', all of them its 'span_id' and 'span_text'
+        line_tolerance: see tag_spans
+
+    Returns:
+        list: the enriched tokens, in order
+    """
+    covered = set()
+    if spans:
+      for span_id, (indices, term) in enumerate(self.tag_spans(tokens, line_tolerance)):
+        # the first token carries the term, the others only mark their part of it
+        first, *rest = indices
+        updates = self._lookup(term)
+        tokens[first].update(updates, span_id=span_id, span_text=updates['text'])
+        for i in rest:
+          updates = self._lookup(term)
+          tokens[i].update(updates, text=tokens[i]['text'].strip().lower(), span_id=span_id,
+                           span_text=updates['text'], span_continuation=True)
+        covered.update(indices)
+
+    return [token if i in covered else self.enrich_token(token) for i, token in enumerate(tokens)]
+
+  def tag_spans(self, tokens, line_tolerance=0.5):
+    """
+    Taxonomy terms written over several consecutive tokens of a line ('cab' 'sav', 'barossa' 'valley').
+
+    Tokens are grouped into lines, a token joining the line whose first token's y is within line_tolerance
+    of its height, and ordered by x. The span keys of a line's tokens are joined with spaces and the
+    taxonomy's term automaton runs once over the joined text; matches starting and ending on token
+    boundaries are kept, longest first from the left, without overlaps.
+
+    Returns:
+        list: (indices of the tokens in tokens, matched term) per span
+    """
+    automaton = self.taxonomy.term_automaton
+    spans = []
+    for line in reading_lines(tokens, line_tolerance):
+      starts, ends = {}, {}
+      parts = []
+      offset = 0
+      for position, i in enumerate(line):
+        key = span_key(tokens[i]['text'])
+        starts[offset] = position
+        ends[offset + len(key)] = position
+        parts.append(key)
+        offset += len(key) + 1
+
+      matches = [(starts[start], ends[end], term) for start, end, term in automaton.finditer(' '.join(parts))
+                 if start in starts and end in ends and ends[end] > starts[start]]
+      last = -1
+      for first, final, term in sorted(matches, key=lambda match: (match[0], -match[1])):
+        if first > last:
+          spans.append((line[first:final + 1], term))
+          last = final
+
+    self.stats['spans'] += len(spans)
+    return spans
+
+  def memo_hit_rate(self):
+    return self.stats['memo_hits'] / self.stats['tokens'] if self.stats['tokens'] else 0.0
+
+  def _lookup(self, text):
+    # classification of a normalized text, from the memo when it was seen recently
+    self.stats['tokens'] += 1
+
+    updates = self.memo.get(text)
+    if updates is None:
+      self.stats['memo_misses'] += 1
+      updates = self._classify(text)
+      self.memo[text] = updates
+      if len(self.memo) > self.memo_size:
+        self.memo.popitem(last=False)
+    else:
+      self.stats['memo_hits'] += 1
+      self.memo.move_to_end(text)
+    return updates
+
+  def _classify(self, text):
+    """
+    Token fields of a normalized text: its classification flag and its cleaned text.
+    """
+    taxonomy = self.taxonomy
 
     # Region
-    if text in self.country_regions:
-      token['is_region'] = True
-      token['text'] = text
-      return token
+    if text in taxonomy.country_regions:
+      return {'is_region': True, 'text': text}
 
     # Country
-    if text in self.countries:
-      token['is_country'] = True
-      token['text'] = text
-      return token
+    if text in taxonomy.countries or text in taxonomy.country_patterns:
+      return {'is_country': True, 'text': text}
 
-    elif text in self.country_patterns:
-      token['is_country'] = True
-      token['text'] = text
-      return token
+    if self.vintage_regex.search(text):
+      return {'is_vintage': True, 'text': text.replace('o', '0').replace('i', '1').replace('l', '1').strip()}
 
-    current_year = 2025  # Replace with dynamic year if needed
-    vintage_pattern = rf'\b(19[5-9]\d|20[0-{str(current_year)[-1]}]\d)(?:\s*(?:vintage|v\.?))?(?:\s*wine)?\b'
+    # Varietal abbreviations first
+    if text in taxonomy.varietal_abbreviations:
+      varietal = taxonomy.varietal_abbreviations[text]
 
-    if re.search(vintage_pattern, text, re.IGNORECASE):
-      token['is_vintage'] = True
-      token['text'] = text.replace('o', '0').replace('i', '1').replace('l', '1').strip()
-      return token
+      # Check if expanded varietal is red or white
+      if varietal in taxonomy.red_varietals:
+        return {'is_varietal_red': True, 'text': varietal}
+      elif varietal in taxonomy.white_varietals:
+        return {'is_varietal_white': True, 'text': varietal}
+      else:
+        return {'is_varietal_other': True, 'text': varietal}
 
-    # Varietal abbreviations first
-    if text in self.varietal_abbreviations:
-        varietal = self.varietal_abbreviations[text]
-        token['text'] = varietal
-
-        # Check if expanded varietal is red or white
-        if varietal in self.red_varietals:
-            token['is_varietal_red'] = True
-            return token
-        
-        elif varietal in self.white_varietals:
-            token['is_varietal_white'] = True
-            return token
-        
-        else:
-          token['is_varietal_other'] = True
-          return token
-
-    if text in self.red_varietals:
-      token['is_varietal_red'] = True
-      token['text'] = text
-      return token
+    if text in taxonomy.red_varietals:
+      return {'is_varietal_red': True, 'text': text}
 
-    elif text in self.white_varietals:
-      token['is_varietal_white'] = True
-      token['text'] = text
-      return token
+    elif text in taxonomy.white_varietals:
+      return {'is_varietal_white': True, 'text': text}
 
     price_match = self.price_regex.search(text)
     if price_match:
-      token['is_price'] = True
-      token['text'] = price_match.group(1)  # Extract just the number
-      return token
+      # Extract just the number
+      return {'is_price': True, 'text': price_match.group(1)}
 
-    # if text.isdigit() or text.startswith('$') or text.startswith('€') or text.startswith('£') or text.endswith('$') or text.endswith('€') or text.endswith('£'):
-    #   price = ''.join([char for char in text if char.isdigit()])
-    #   try:
-    #     (float(price))
-    #     token['is_price'] = True
-    #     token['text'] = price
-    #     return token
-    #   except:
-    #     print(f"Error converting price {text}")
+    # misread terms, nearest first
+    distance = max((edits for edits, length in FUZZY_MIN_LENGTH.items() if len(text) >= length), default=0)
+    distance = 0 if text in FUZZY_STOP_WORDS else min(self.fuzzy_distance, distance)
+    for term, edits in taxonomy.term_index.candidates(text, distance) if distance > 0 else ():
+      if ocr_misread(text, term):
+        updates = self._classify(term)
+        return {**updates, 'text': text, 'term': updates['text'], 'edit_distance': edits}
 
-    return token
+    # unclassified tokens keep their text as is
+    return {}
@@ -89,7 +89,12 @@ class WineMenuGrouper:
         sorted_tokens = sorted(token_group, key=lambda t: t.get('x', 0))
         
         for token in sorted_tokens:
-            text = token.get('text', '').strip()
+            # a term split over several tokens is carried by its first token
+            if token.get('span_continuation'):
+                continue
+
+            # a misread term is read as its correction, its OCR text stays in 'text'
+            text = token.get('term', token.get('text', '')).strip()
             
             if token.get('is_vintage'):
                 try:
@@ -0,0 +1,55 @@
+class AhoCorasick:
+    """
+    Aho-Corasick automaton from patterns to values, finding every occurrence of every pattern in a text in
+    one pass over it, whatever the number of patterns.
+    """
+
+    def __init__(self, patterns=None):
+        # state 0 is the root; per state its transitions, failure state and (pattern length, value) outputs
+        self.transitions = [{}]
+        self.failure = [0]
+        self.outputs = [()]
+
+        for pattern, value in (patterns or {}).items():
+            self._insert(pattern, value)
+        self._link()
+
+    def finditer(self, text):
+        """
+        (start, end, value) of each pattern occurrence in text, by end position then longest first.
+        """
+        transitions, failure, outputs = self.transitions, self.failure, self.outputs
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in transitions[state]:
+                state = failure[state]
+            state = transitions[state].get(char, 0)
+            for length, value in outputs[state]:
+                yield end - length, end, value
+
+    def _insert(self, pattern, value):
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            following = self.transitions[state].get(char)
+            if following is None:
+                following = len(self.transitions)
+                self.transitions[state][char] = following
+                self.transitions.append({})
+                self.failure.append(0)
+                self.outputs.append(())
+            state = following
+        self.outputs[state] = ((len(pattern), value),)
+
+    def _link(self):
+        # breadth first, so the failure state of a state's parent is linked before the state itself
+        queue = list(self.transitions[0].values())
+        for state in queue:
+            for char, following in self.transitions[state].items():
+                fallback = self.failure[state]
+                while fallback and char not in self.transitions[fallback]:
+                    fallback = self.failure[fallback]
+                self.failure[following] = self.transitions[fallback].get(char, 0)
+                self.outputs[following] += self.outputs[self.failure[following]]
+                queue.append(following)
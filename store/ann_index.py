@@ -0,0 +1,156 @@
+import json
+import os
+import time
+import zlib
+
+import faiss
+import numpy as np
+
+from store.ngram_index import text_ngrams
+
+ANN_DIMENSION = 256
+ANN_VERSION = 2
+ANN_COLUMNS = ('description_key', 'winery_key', 'region_key')
+
+# below this many wines a flat (exact inner product) index is both fast and exact
+IVF_MIN_ROWS = 20000
+
+
+def hash_vectors(texts, dimension=ANN_DIMENSION):
+    """
+    L2-normalized hashed character n-gram counts, one float32 vector per text.
+    """
+    vectors = np.zeros((len(texts), dimension), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for gram in text_ngrams(text):
+            vectors[i, zlib.crc32(gram.encode('utf-8')) % dimension] += 1
+
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def wine_texts(df, columns=ANN_COLUMNS):
+    """
+    One text per wine: its description, winery and region joined.
+    """
+    values = [df[column].astype('string').fillna('').tolist() for column in columns if column in df.columns]
+    return [' '.join(text for text in texts if text) for texts in zip(*values)]
+
+
+def menu_text(menu_entry):
+    # menu entries are normalized, so this matches the key columns
+    return ' '.join(str(menu_entry[key]) for key in ('description', 'region') if menu_entry.get(key))
+
+
+class AnnIndex:
+    """
+    FAISS index over hashed n-gram vectors of the store wines, ids are store row positions.
+    """
+
+    def __init__(self, index, fingerprint=None, nprobe=16):
+        self.index = index
+        self.fingerprint = fingerprint
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, df, fingerprint=None, dimension=ANN_DIMENSION):
+        vectors = hash_vectors(wine_texts(df), dimension)
+
+        if len(vectors) < IVF_MIN_ROWS:
+            index = faiss.IndexFlatIP(dimension)
+        else:
+            # faiss wants ~39 training points per centroid
+            nlist = min(4096, int(4 * np.sqrt(len(vectors))), len(vectors) // 39)
+            index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dimension), dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+            sample = np.random.default_rng(0).choice(len(vectors), min(len(vectors), nlist * 64), replace=False)
+            index.train(vectors[np.sort(sample)])
+
+        index.add(vectors)
+        return cls(index, fingerprint)
+
+    def query(self, text, limit, rows=None):
+        """
+        Approximate nearest wines of a text.
+
+        Args:
+            text: menu text
+            limit: maximum number of rows returned
+            rows: optional slice of store rows (a partition) restricting the search
+
+        Returns:
+            np.ndarray: row positions, ascending
+        """
+        if not text or self.index.ntotal == 0:
+            return np.empty(0, dtype=np.int64)
+
+        start, stop = (0, self.index.ntotal) if rows is None else (rows.start, rows.stop)
+        selector = faiss.IDSelectorRange(start, stop)
+        if isinstance(self.index, faiss.IndexIVF):
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+
+        _, ids = self.index.search(hash_vectors([text], self.index.d), min(limit, stop - start), params=params)
+        ids = ids[0]
+        return np.sort(ids[ids >= 0])
+
+    def query_entry(self, menu_entry, limit, rows=None):
+        return self.query(menu_text(menu_entry), limit, rows)
+
+    def save(self, path):
+        faiss.write_index(self.index, path)
+        with open(f'{path}.json', 'w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'version': ANN_VERSION}, f)
+
+    @classmethod
+    def open(cls, path, fingerprint):
+        """
+        Memory-map a persisted index, or None when it is missing or was built from other data.
+        """
+        if not os.path.exists(path) or not os.path.exists(f'{path}.json'):
+            return None
+
+        with open(f'{path}.json') as f:
+            meta = json.load(f)
+        if meta.get('version') != ANN_VERSION or meta.get('fingerprint') != fingerprint:
+            return None
+
+        return cls(faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY), fingerprint)
+
+
+def benchmark(store, menu_entries):
+    """
+    Recall and latency of the ANN candidate mode against exact scoring of whole partitions.
+
+    Args:
+        store: loaded WineStore with candidate_mode='ann'
+        menu_entries: menu entries to match
+
+    Returns:
+        dict: recall@1 (share of queries where the ANN best match scores as high as the exact one),
+              and mean/p95 per-query latency (ms) of both paths
+    """
+    mode, cache = store.candidate_mode, store.cache
+    timings = {'exact': [], 'ann': []}
+    best_scores = {}
+
+    # every query is timed and scored by its own path, never answered from the match cache
+    store.cache = None
+    try:
+        for candidate_mode in timings:
+            store.candidate_mode = candidate_mode
+            for i, menu_entry in enumerate(menu_entries):
+                start = time.perf_counter()
+                _, score = store.retrieve_wine(menu_entry)
+                timings[candidate_mode].append((time.perf_counter() - start) * 1000)
+                best_scores[candidate_mode, i] = score
+    finally:
+        store.candidate_mode, store.cache = mode, cache
+
+    hits = sum(best_scores['ann', i] >= best_scores['exact', i] for i in range(len(menu_entries)))
+    report = {'queries': len(menu_entries), 'recall': float(hits / len(menu_entries)) if menu_entries else 0.0}
+    for candidate_mode, values in timings.items():
+        report[f'{candidate_mode}_mean_ms'] = float(np.mean(values)) if values else 0.0
+        report[f'{candidate_mode}_p95_ms'] = float(np.percentile(values, 95)) if values else 0.0
+
+    return report
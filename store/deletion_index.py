@@ -0,0 +1,63 @@
+from rapidfuzz.distance import Levenshtein
+
+
+def deletions(word, max_distance):
+    """
+    The word and every string obtained by deleting up to max_distance of its characters.
+    """
+    found = {word}
+    level = {word}
+    for _ in range(max_distance):
+        level = {variant[:i] + variant[i + 1:] for variant in level for i in range(len(variant))} - found
+        found |= level
+    return found
+
+
+class DeletionIndex:
+    """
+    Symmetric deletion (SymSpell) index of a vocabulary, answering the nearest term within an edit distance.
+
+    Every deletion of up to max_distance characters of each term is indexed once. Two strings within
+    Levenshtein distance d share a deletion of at most d characters of each, so a lookup only generates the
+    deletions of the word and checks the few terms indexed under them, instead of every term.
+    """
+
+    def __init__(self, terms, max_distance=2):
+        self.max_distance = max_distance
+        self.terms = list(dict.fromkeys(terms))
+        self.index = {}
+        for position, term in enumerate(self.terms):
+            for deletion in deletions(term, max_distance):
+                self.index.setdefault(deletion, []).append(position)
+
+    def lookup(self, word, max_distance=None):
+        """
+        (term, distance) of the nearest term within max_distance (at most the index's) of word, the first
+        listed term among the nearest, or None.
+        """
+        candidates = self.candidates(word, max_distance)
+        return candidates[0] if candidates else None
+
+    def candidates(self, word, max_distance=None):
+        """
+        (term, distance) of every term within max_distance (at most the index's) of word, nearest first,
+        then in listed order.
+        """
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        if max_distance < 0:
+            return []
+
+        found = {}
+        for deletion in deletions(word, max_distance):
+            for position in self.index.get(deletion, ()):
+                if position in found:
+                    continue
+                term = self.terms[position]
+                if abs(len(term) - len(word)) > max_distance:
+                    continue
+                distance = Levenshtein.distance(word, term, score_cutoff=max_distance)
+                if distance <= max_distance:
+                    found[position] = distance
+
+        return [(self.terms[position], distance)
+                for position, distance in sorted(found.items(), key=lambda item: (item[1], item[0]))]
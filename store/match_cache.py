@@ -0,0 +1,91 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class MatchCache:
+    """
+    Two-tier cache of store matches: an in-process LRU, optionally backed by a SQLite file
+    shared by worker processes.
+
+    Keys are strings built by the store from the store fingerprint, its retrieval settings and the
+    normalized menu entry, values are JSON-serializable (row position, score, path) tuples. Evictions
+    of both tiers are counted in stats['evictions'].
+    """
+
+    def __init__(self, maxsize=4096, path=None, max_rows=1_000_000):
+        """
+        Args:
+            maxsize: entries kept in the in-process LRU
+            path: optional SQLite file of the shared tier
+            max_rows: entries kept in the SQLite tier, least recently used are evicted beyond that
+        """
+        self.maxsize = maxsize
+        self.max_rows = max_rows
+        self.memory = OrderedDict()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.conn = None
+        self._puts = 0
+
+        if path is not None:
+            self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS matches (key TEXT PRIMARY KEY, value TEXT, used REAL)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS matches_used ON matches (used)')
+
+    def get(self, key):
+        """
+        Cached value of a key, or None.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.stats['memory_hits'] += 1
+            return self.memory[key]
+
+        if self.conn is not None:
+            row = self.conn.execute('SELECT value FROM matches WHERE key = ?', (key,)).fetchone()
+            if row is not None:
+                self.conn.execute('UPDATE matches SET used = ? WHERE key = ?', (time.time(), key))
+                self.stats['disk_hits'] += 1
+                value = tuple(json.loads(row[0]))
+                self._remember(key, value)
+                return value
+
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+
+        if self.conn is not None:
+            self.conn.execute('INSERT OR REPLACE INTO matches VALUES (?, ?, ?)', (key, json.dumps(value), time.time()))
+
+            # evict in batches, counting rows on every put would cost more than the insert
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                self._evict()
+
+    def hit_rate(self):
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return hits / total if total else 0.0
+
+    def clear(self):
+        self.memory.clear()
+        if self.conn is not None:
+            self.conn.execute('DELETE FROM matches')
+
+    def _remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.maxsize:
+            self.memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def _evict(self):
+        (rows,) = self.conn.execute('SELECT COUNT(*) FROM matches').fetchone()
+        if rows > self.max_rows:
+            self.conn.execute('DELETE FROM matches WHERE key IN (SELECT key FROM matches ORDER BY used LIMIT ?)',
+                              (rows - self.max_rows,))
+            self.stats['evictions'] += rows - self.max_rows
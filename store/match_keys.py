@@ -0,0 +1,65 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from config.wine import MATCH_STOP_WORDS
+
+# text columns compared by the matcher, each gets a normalized '<column>_key' column
+KEY_COLUMNS = ('description', 'winery', 'region', 'country', 'variety', 'type')
+
+APOSTROPHE_REGEX = re.compile(r"['’`´]")
+PUNCTUATION_REGEX = re.compile(r'[\W_]+')
+STOP_WORDS = frozenset(MATCH_STOP_WORDS)
+
+
+def key_column(column):
+    return f'{column}_key'
+
+
+def normalize_key(text):
+    """
+    Normalize a text into a stable match key: casefolded, accent-folded, punctuation and
+    whitespace collapsed, stop words (MATCH_STOP_WORDS) removed.
+
+    "Château PENFOLDS, Hárslevelű" -> "penfolds harslevelu"
+    """
+    if text is None or text is pd.NA or (isinstance(text, float) and np.isnan(text)):
+        return ''
+
+    text = unicodedata.normalize('NFKD', str(text))
+    text = ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+    text = PUNCTUATION_REGEX.sub(' ', APOSTROPHE_REGEX.sub('', text))
+
+    return ' '.join(word for word in text.split() if word not in STOP_WORDS)
+
+
+def normalize_entry(menu_entry):
+    """
+    Copy of a menu entry with its text fields normalized like the store keys.
+    """
+    return {key: normalize_key(value) if key in KEY_COLUMNS else value for key, value in menu_entry.items()}
+
+
+def normalize_column(values):
+    """
+    Normalized keys of a column, computed once per distinct value; missing values stay missing.
+    """
+    codes, uniques = pd.factorize(values)
+    keys = np.array([normalize_key(value) for value in uniques] + [None], dtype=object)
+
+    # code -1 (missing) picks the trailing None
+    keys = pd.Series(keys[codes], index=values.index, dtype='string')
+    return keys.astype('category') if isinstance(values.dtype, pd.CategoricalDtype) else keys
+
+
+def add_match_keys(df):
+    """
+    Add the '<column>_key' columns of KEY_COLUMNS to a store frame, unless already there.
+    """
+    for column in KEY_COLUMNS:
+        if column in df.columns and key_column(column) not in df.columns:
+            df[key_column(column)] = normalize_column(df[column])
+
+    return df
@@ -0,0 +1,181 @@
+import numpy as np
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+
+# (menu key, wine column, weight), summed in the same order as WineStore._calculate_match_score.
+# Text fields compare normalized keys: menu entries go through match_keys.normalize_entry first.
+MATCH_WEIGHTS = [
+    ('description', 'description_key', 0.4),
+    ('description', 'winery_key', 0.3),
+    ('year', 'year', 0.2),
+    ('region', 'region_key', 0.4),
+    ('country', 'country_key', 0.2),
+    ('variety', 'variety_key', 0.1),
+    ('type', 'type_key', 0.1),
+]
+
+YEAR_TOLERANCE = 1          # ±1 year still scores
+YEAR_TOLERANCE_WEIGHT = 0.1
+
+# long texts, only scored while a candidate can still make the top k
+EXPENSIVE_COLUMNS = ('description_key', 'winery_key')
+
+
+class CandidateBlock:
+    """
+    Column arrays of a candidate frame, prepared once so a whole block is scored per call.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.size = len(df)
+        self.strings = {}
+        self.valid = {}
+        self.years = None
+
+        for _, column, _ in MATCH_WEIGHTS:
+            if column not in df.columns or column in self.strings:
+                continue
+
+            if column == 'year':
+                self.years = df['year'].astype('Float64').to_numpy(dtype=np.float64, na_value=np.nan)
+            else:
+                values = df[column]
+                self.valid[column] = values.notna().to_numpy()
+                self.strings[column] = np.array(values.astype('string').fillna('').tolist(), dtype=object)
+
+    def __len__(self):
+        return self.size
+
+    def take(self, positions):
+        """
+        Sub-block of the given candidate positions, without preparing the columns again.
+        Only meant for scoring: the frame is not sliced along.
+        """
+        block = CandidateBlock.__new__(CandidateBlock)
+        block.df = None
+        block.size = len(positions)
+        block.strings = {column: values[positions] for column, values in self.strings.items()}
+        block.valid = {column: valid[positions] for column, valid in self.valid.items()}
+        block.years = None if self.years is None else self.years[positions]
+        return block
+
+
+def score_block(menu_entries, block):
+    """
+    Score menu entries against every wine of a candidate block.
+
+    Args:
+        menu_entries: normalized menu entries, with keys like 'description', 'year', 'region', 'country', 'variety', 'type'
+        block: CandidateBlock
+
+    Returns:
+        np.ndarray: (len(menu_entries), len(block)) scores, same weights as WineStore._calculate_match_score
+    """
+    scores = np.zeros((len(menu_entries), len(block)))
+
+    for key, column, weight in MATCH_WEIGHTS:
+        scores += _field_scores(menu_entries, block, key, column, weight)
+
+    return scores
+
+
+def top_k_block(menu_entry, block, k, chunk_size=256):
+    """
+    Best k candidates of a block for one menu entry, with upper-bound pruning.
+
+    The cheap fields are scored for every candidate first. Adding the full weight of the
+    expensive text fields gives the best score a candidate can still reach; candidates are
+    then fully scored in descending bound order until no bound can beat the k-th best.
+
+    Args:
+        menu_entry: menu entry dict, as for score_block
+        block: CandidateBlock
+        k: number of matches kept
+        chunk_size: candidates fully scored by the first similarity matrix call, doubled on every further call
+
+    Returns:
+        tuple: (positions, scores, pruned) - block positions and scores best first (positive scores only),
+               and the number of candidates whose expensive fields were never scored
+    """
+    menu_entries = [menu_entry]
+
+    cheap = {}
+    bound = np.zeros(len(block))
+    for key, column, weight in MATCH_WEIGHTS:
+        if column not in EXPENSIVE_COLUMNS:
+            cheap[column] = _field_scores(menu_entries, block, key, column, weight)[0]
+            bound += cheap[column]
+        elif key in menu_entry and column in block.valid:
+            bound += np.where(block.valid[column], weight, 0.0)
+
+    order = np.argsort(-bound, kind='stable')
+    positions = np.empty(0, dtype=np.int64)
+    scores = np.empty(0)
+    scored = 0
+
+    start = 0
+    while start < len(order):
+        chunk = order[start:start + chunk_size]
+        start += chunk_size
+        chunk_size *= 2
+
+        if len(scores) == k:
+            # small slack so float rounding in the bound never prunes a tie
+            chunk = chunk[bound[chunk] >= scores[-1] - 1e-9]
+            if len(chunk) == 0:
+                break
+
+        sub_block = block.take(chunk)
+        chunk_scores = np.zeros(len(chunk))
+        for key, column, weight in MATCH_WEIGHTS:
+            if column in EXPENSIVE_COLUMNS:
+                chunk_scores += _field_scores(menu_entries, sub_block, key, column, weight)[0]
+            else:
+                chunk_scores += cheap[column][chunk]
+        scored += len(chunk)
+
+        positions = np.concatenate([positions, chunk])
+        scores = np.concatenate([scores, chunk_scores])
+        best = np.lexsort((positions, -scores))[:k]
+        positions, scores = positions[best], scores[best]
+
+    keep = scores > 0
+    return positions[keep], scores[keep], len(block) - scored
+
+
+def _field_scores(menu_entries, block, key, column, weight):
+    if column == 'year':
+        return _year_scores(menu_entries, block, weight)
+    return _text_scores(menu_entries, block, key, column, weight)
+
+
+def _text_scores(menu_entries, block, key, column, weight):
+    scores = np.zeros((len(menu_entries), len(block)))
+    rows = [i for i, entry in enumerate(menu_entries) if key in entry]
+    if not rows or column not in block.strings or len(block) == 0:
+        return scores
+
+    queries = [str(menu_entries[i][key]) for i in rows]
+
+    # fuzz.ratio rounds to whole percents (fuzzywuzzy), keep that so scores stay comparable
+    ratios = np.rint(cdist(queries, block.strings[column], scorer=fuzz.ratio, dtype=np.float64, workers=-1))
+    scores[rows] = np.where(block.valid[column], ratios / 100 * weight, 0.0)
+
+    return scores
+
+
+def _year_scores(menu_entries, block, weight):
+    scores = np.zeros((len(menu_entries), len(block)))
+    if block.years is None:
+        return scores
+
+    for i, entry in enumerate(menu_entries):
+        year = entry.get('year')
+        if year is None:
+            continue
+
+        diff = np.abs(block.years - year)
+        scores[i] = np.where(diff == 0, weight, np.where(diff <= YEAR_TOLERANCE, YEAR_TOLERANCE_WEIGHT, 0.0))
+
+    return scores
@@ -0,0 +1,121 @@
+import hashlib
+import os
+
+import numpy as np
+
+NGRAM_SIZE = 3
+INDEX_VERSION = 3
+
+
+def file_fingerprint(path, block_size=1 << 20):
+    """
+    Content hash of a store file, used to tell whether derived artifacts are stale.
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_ngrams(text, n=NGRAM_SIZE):
+    """
+    Set of character n-grams of a lowercased, space-padded text.
+    """
+    if not text:
+        return set()
+
+    text = f' {str(text).lower()} '
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class NgramIndex:
+    """
+    Inverted index from character n-grams to store row positions (CSR layout).
+
+    Postings of gram i are postings[offsets[i]:offsets[i + 1]], sorted by row.
+    """
+
+    def __init__(self, grams, offsets, postings, n_rows, fingerprint=None):
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.n_rows = n_rows
+        self.fingerprint = fingerprint
+        self.vocabulary = {gram: i for i, gram in enumerate(grams.tolist())}
+
+    @classmethod
+    def build(cls, df, columns=('description_key', 'winery_key'), fingerprint=None):
+        """
+        Build the index over the n-grams of the given text columns of a store frame.
+        """
+        vocabulary = {}
+        gram_ids = []
+        rows = []
+
+        values = [df[column].astype('string').fillna('').tolist() for column in columns if column in df.columns]
+        for row, texts in enumerate(zip(*values)):
+            grams = set().union(*(text_ngrams(text) for text in texts))
+            gram_ids.extend(vocabulary.setdefault(gram, len(vocabulary)) for gram in grams)
+            rows.extend([row] * len(grams))
+
+        gram_ids = np.asarray(gram_ids, dtype=np.int32)
+        order = np.argsort(gram_ids, kind='stable')
+
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        offsets[1:] = np.bincount(gram_ids, minlength=len(vocabulary)).cumsum()
+
+        grams = np.array(list(vocabulary), dtype=str)
+        postings = np.asarray(rows, dtype=np.int32)[order]
+
+        return cls(grams, offsets, postings, len(df), fingerprint)
+
+    def query(self, text, limit, rows=None):
+        """
+        Rows sharing the most n-grams with a text.
+
+        Args:
+            text: query text (menu description)
+            limit: maximum number of rows returned
+            rows: optional slice of store rows (a partition) restricting the result
+
+        Returns:
+            np.ndarray: row positions, ascending
+        """
+        start, stop = (0, self.n_rows) if rows is None else (rows.start, rows.stop)
+
+        ids = [self.vocabulary[gram] for gram in text_ngrams(text) if gram in self.vocabulary]
+        if not ids or stop <= start:
+            return np.empty(0, dtype=np.int64)
+
+        # postings are sorted by row, so each list is cut down to the partition with two binary searches
+        hits = []
+        for i in ids:
+            postings = self.postings[self.offsets[i]:self.offsets[i + 1]]
+            hits.append(postings[np.searchsorted(postings, start):np.searchsorted(postings, stop)])
+
+        counts = np.bincount(np.concatenate(hits) - start, minlength=stop - start)
+        rows = np.flatnonzero(counts)
+
+        if len(rows) > limit:
+            rows = np.sort(rows[np.argpartition(-counts[rows], limit - 1)[:limit]])
+
+        return rows + start
+
+    def save(self, path):
+        np.savez(path, grams=self.grams, offsets=self.offsets, postings=self.postings,
+                 n_rows=self.n_rows, fingerprint=self.fingerprint or '', version=INDEX_VERSION)
+
+    @classmethod
+    def open(cls, path, fingerprint):
+        """
+        Load a persisted index, or None when it is missing or was built from other data.
+        """
+        if not os.path.exists(path):
+            return None
+
+        with np.load(path) as data:
+            if int(data['version']) != INDEX_VERSION or str(data['fingerprint']) != fingerprint:
+                return None
+
+            return cls(data['grams'], data['offsets'], data['postings'], int(data['n_rows']), fingerprint)
@@ -0,0 +1,31 @@
+class PrefixTrie:
+    """
+    Character trie from patterns to values, answering the longest pattern a text starts with.
+    """
+
+    # key of the value stored on the node ending a pattern, never a single character
+    _VALUE = ''
+
+    def __init__(self, patterns=None):
+        self.root = {}
+        for pattern, value in (patterns or {}).items():
+            self.insert(pattern, value)
+
+    def insert(self, pattern, value):
+        node = self.root
+        for char in pattern:
+            node = node.setdefault(char, {})
+        node[self._VALUE] = value
+
+    def longest_prefix(self, text):
+        """
+        Value of the longest pattern text starts with, or None; walks at most len(text) nodes.
+        """
+        node = self.root
+        value = node.get(self._VALUE)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            value = node.get(self._VALUE, value)
+        return value
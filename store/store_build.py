@@ -0,0 +1,352 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from store.match_keys import add_match_keys
+from store.ngram_index import file_fingerprint
+from store.store_dedupe import dedupe_store
+from store.store_loader import TAXONOMY_GROUPS, WINE_DTYPES, concat_frames, taxonomy_fingerprints
+from store.store_table import write_store_table
+from store.vivino_loader import VivinoLoader
+from store.wine_store import (PARTITION_COLUMNS, STORE_FORMAT, STORE_METADATA, STORE_TABLE, TABLE_SUFFIXES, WineStore,
+                              write_current)
+from store.winemag_loader import WinemagLoader
+
+logger = logging.getLogger(__name__)
+
+# bump when a loader's prepare or derive changes, every fragment is rebuilt then
+FRAGMENT_VERSION = 1
+
+# source name -> (loader class, default glob of its review files)
+SOURCES = {
+    'vivino': (VivinoLoader, 'data/review/vivino**.csv'),
+    'winemag': (WinemagLoader, 'data/review/winemag**.csv'),
+}
+
+
+class FragmentCache:
+    """
+    Manifest of the input files of a store build and the columnar fragments cached for each.
+
+    A file has one fragment of prepared rows, named after its content hash, and one fragment per
+    taxonomy group of derived columns, also named after the hash of the config/wine.py settings they
+    come from. An unchanged file is never parsed again, and a taxonomy change only rebuilds its group.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self.manifest = {'version': FRAGMENT_VERSION, 'files': {}}
+        self.used = set()
+        self.stats = {'files': 0, 'hashed': 0, 'parsed': 0, 'derived': 0}
+
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            if manifest.get('version') == FRAGMENT_VERSION:
+                self.manifest = manifest
+
+    def load(self, loader, source, file, taxonomy):
+        """
+        Normalized rows of one file, from the cached fragments when they are current.
+
+        Args:
+            loader: StoreLoader of the source
+            source: source name, part of the fragment names
+            file: input file
+            taxonomy: taxonomy_fingerprints() of the build
+
+        Returns:
+            pd.DataFrame: the rows loader.normalize would give
+        """
+        base, fragments = self._fragments(source, file, taxonomy)
+        self.stats['files'] += 1
+
+        df = self._read(base)
+        if df is None:
+            df = self._parse(loader, file, base)
+            self.stats['parsed'] += 1
+
+        derived = []
+        for group, fragment in fragments.items():
+            columns = self._read(fragment)
+            if columns is None:
+                columns = self._derive(loader, df, group, fragment)
+                self.stats['derived'] += 1
+            derived.append(columns)
+
+        for columns in derived:
+            df[list(columns.columns)] = columns
+        return df
+
+    def prefetch(self, loader, source, files, taxonomy, workers):
+        """
+        Build the missing fragments of files in worker processes, so that load only reads them.
+        """
+        jobs = []
+        for file in files:
+            base, fragments = self._fragments(source, file, taxonomy)
+            missing = [group for group, fragment in fragments.items() if not self._exists(fragment)]
+            if not self._exists(base) or missing:
+                jobs.append((file, base, {group: fragments[group] for group in missing}))
+
+        if workers <= 1 or len(jobs) <= 1:
+            return
+
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            for parsed, derived in pool.map(self._build, [loader] * len(jobs), jobs):
+                self.stats['parsed'] += parsed
+                self.stats['derived'] += derived
+
+    def save(self, files):
+        """
+        Write the manifest of the built files and delete the fragments no longer used.
+        """
+        self.manifest['files'] = {file: entry for file, entry in self.manifest['files'].items() if file in files}
+        self.manifest['taxonomy'] = taxonomy_fingerprints()
+
+        with open(f'{self.manifest_path}.tmp', 'w') as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(f'{self.manifest_path}.tmp', self.manifest_path)
+
+        for fragment in os.listdir(self.path):
+            if fragment.endswith('.arrow') and fragment not in self.used:
+                os.remove(os.path.join(self.path, fragment))
+
+    def _digest(self, source, file):
+        # files whose size and mtime did not move keep their hash, hashing reads the whole file
+        stat = os.stat(file)
+        entry = self.manifest['files'].get(file)
+        if entry and entry['source'] == source and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha1']
+
+        digest = file_fingerprint(file)
+        self.stats['hashed'] += 1
+        self.manifest['files'][file] = {'source': source, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest}
+        return digest
+
+    def _fragments(self, source, file, taxonomy):
+        # fragment of the prepared rows, and fragment of each taxonomy group's derived columns
+        name = f'{source}-{self._digest(source, file)}'
+        return f'{name}.arrow', {group: f'{name}.{group}-{taxonomy[group][:16]}.arrow' for group in TAXONOMY_GROUPS}
+
+    def _build(self, loader, job):
+        # worker side of prefetch: the fragments are files, the parent reads them back in load
+        file, base, fragments = job
+        df = self._read(base)
+        parsed = df is None
+        if parsed:
+            df = self._parse(loader, file, base)
+        for group, fragment in fragments.items():
+            self._derive(loader, df, group, fragment)
+        return int(parsed), len(fragments)
+
+    def _parse(self, loader, file, fragment):
+        df = loader.prepare(concat_frames(list(loader.read_file(file)))).reset_index(drop=True)
+        return self._write(fragment, df)
+
+    def _derive(self, loader, df, group, fragment):
+        return self._write(fragment, loader.derive(df, group))
+
+    def _exists(self, fragment):
+        return os.path.exists(os.path.join(self.path, fragment))
+
+    def _read(self, fragment):
+        self.used.add(fragment)
+        path = os.path.join(self.path, fragment)
+        if not os.path.exists(path):
+            return None
+        return feather.read_table(path).to_pandas()
+
+    def _write(self, fragment, df):
+        # returns the frame as _read gives it back, so cold, warm and pooled builds see the same dtypes
+        path = os.path.join(self.path, fragment)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        feather.write_feather(table, f'{path}.tmp', compression='uncompressed')
+        os.replace(f'{path}.tmp', path)
+        return table.to_pandas()
+
+
+def build_store(output='data/store/master.csv', cache_dir='data/store/cache', sources=None, dedupe=True, workers=1):
+    """
+    Build the master store from the review dumps, reusing the fragments of unchanged files.
+
+    Args:
+        output: master store file, a CSV or (.arrow/.feather) a store table with match keys
+        cache_dir: directory of the manifest and the fragments
+        sources: source name -> (loader class, glob), SOURCES by default
+        dedupe: merge the rows of the same wine across sources (store_dedupe.dedupe_store)
+        workers: processes parsing and deriving the files missing from the cache
+
+    Returns:
+        dict: rows written, files seen, files hashed and parsed, derived fragments rebuilt,
+              the dedupe report and seconds taken
+    """
+    start = time.perf_counter()
+    cache = FragmentCache(cache_dir)
+    df, report = load_sources(cache, sources, dedupe, workers)
+
+    write_master(df, output)
+    cache.save(report.pop('files'))
+
+    report = {'rows': len(df), **cache.stats, **report, 'seconds': time.perf_counter() - start}
+    logger.info("%s: %d rows, %d files (%d parsed), %d derived fragments rebuilt in %.1fs",
+                output, report['rows'], report['files'], report['parsed'], report['derived'], report['seconds'])
+    return report
+
+
+def build_store_dir(root='data/store', cache_dir='data/store/cache', sources=None, dedupe=True, ann=False,
+                    workers=1):
+    """
+    Build a versioned store directory and point root/CURRENT at it.
+
+    root/<version>/ holds the store table (STORE_TABLE) with its match keys, sorted by partition, the
+    n-gram index (and the FAISS index with ann), the partition map and exact lookup maps (STORE_LOOKUPS),
+    and STORE_METADATA with row counts, build timings and the content fingerprint. A version is never
+    modified once written: WineStore(root) opens the current one, WineStore(root/<version>) a given one.
+
+    Args:
+        root: directory of the store versions
+        cache_dir: directory of the manifest and the fragments
+        sources: source name -> (loader class, glob), SOURCES by default
+        dedupe: merge the rows of the same wine across sources
+        ann: also build the FAISS index
+        workers: processes parsing and deriving the files missing from the cache
+
+    Returns:
+        str: path of the new version
+    """
+    timings = {}
+    start = time.perf_counter()
+    cache = FragmentCache(cache_dir)
+    df, report = load_sources(cache, sources, dedupe, workers)
+    files = report.pop('files')
+    timings['load'] = time.perf_counter() - start
+
+    started = datetime.now(timezone.utc)
+    staging = os.path.join(root, f'.{started:%Y%m%dT%H%M%S%f}.tmp')
+    os.makedirs(staging)
+
+    step = time.perf_counter()
+    table_path = os.path.join(staging, STORE_TABLE)
+    fingerprint = write_master(df, table_path)
+    timings['table'] = time.perf_counter() - step
+
+    # the store computes its partitions and indexes once here, readers only open them
+    step = time.perf_counter()
+    store = WineStore(table_path, partition_depth=len(PARTITION_COLUMNS), candidate_mode='ann' if ann else 'ngram')
+    store.load()
+    if ann:
+        store.load_index('ngram')
+    store.save_lookups(staging)
+    timings['indexes'] = time.perf_counter() - step
+
+    version = f'{started:%Y%m%dT%H%M%S}-{fingerprint[:8]}'
+    metadata = {
+        'format': STORE_FORMAT,
+        'version': version,
+        'created': started.isoformat(),
+        'fingerprint': fingerprint,
+        'rows': len(df),
+        'sources': {source: int(rows) for source, rows in df['source'].value_counts(sort=False).items()},
+        'partitions': store.partition_stats()['partitions'],
+        'partition_depth': len(PARTITION_COLUMNS),
+        'ann': ann,
+        **report,
+        'inputs': {file: cache.manifest['files'][file]['sha1'] for file in sorted(files)},
+        'timings': {**timings, 'total': time.perf_counter() - start},
+    }
+    with open(os.path.join(staging, STORE_METADATA), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    path = os.path.join(root, version)
+    os.replace(staging, path)
+    write_current(root, version)
+    cache.save(files)
+
+    logger.info("%s: %d rows, %d partitions, built in %.1fs", path, metadata['rows'], metadata['partitions'],
+                metadata['timings']['total'])
+    return path
+
+
+def load_sources(cache, sources=None, dedupe=True, workers=1):
+    """
+    Normalized rows of all sources, tagged with their source and optionally deduplicated.
+
+    With workers > 1, the files missing from the cache are parsed and derived in a process pool first.
+
+    Returns:
+        tuple: (frame, report dict with the files read and the dedupe report)
+    """
+    taxonomy = taxonomy_fingerprints()
+
+    files = set()
+    frames = []
+    for source, (loader_class, path_pattern) in (sources or SOURCES).items():
+        loader = loader_class(path_pattern)
+        source_files = loader.files()
+        files.update(source_files)
+
+        cache.prefetch(loader, source, source_files, taxonomy, workers)
+        df = concat_frames([cache.load(loader, source, file, taxonomy) for file in source_files])
+        df = loader.finish(df)
+        df = df.astype({column: dtype for column, dtype in WINE_DTYPES.items() if column in df.columns})
+        df['source'] = pd.Categorical([source] * len(df))
+        frames.append(df)
+
+    df = concat_frames(frames)
+    report = {'files': files}
+    if dedupe:
+        df, report['dedupe'] = dedupe_store(df)
+
+    return df, report
+
+
+def write_master(df, output):
+    """
+    Write the master store as CSV, or as a store table with match keys (.arrow/.feather).
+
+    Returns:
+        str: fingerprint of the written store table, None for CSV
+    """
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    if output.endswith(TABLE_SUFFIXES):
+        return write_store_table(add_match_keys(df), output, sort_by=PARTITION_COLUMNS)
+
+    df.to_csv(output, index=False)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the wine store from the review dumps.')
+    parser.add_argument('--root', default='data/store', help='directory of the versioned stores')
+    parser.add_argument('--output', help='write a single master file (.csv, .arrow or .feather) instead of a store version')
+    parser.add_argument('--cache', default='data/store/cache', help='manifest and fragment directory')
+    for source, (_, path_pattern) in SOURCES.items():
+        parser.add_argument(f'--{source}', default=path_pattern, help=f'glob of the {source} review files')
+    parser.add_argument('--no-dedupe', action='store_true', help='keep the duplicates across sources')
+    parser.add_argument('--ann', action='store_true', help='also build the FAISS index of the store version')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='processes parsing the files missing from the cache (default: all cores)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sources = {source: (loader_class, getattr(args, source)) for source, (loader_class, _) in SOURCES.items()}
+    if args.output:
+        build_store(args.output, args.cache, sources, dedupe=not args.no_dedupe, workers=args.workers)
+    else:
+        print(build_store_dir(args.root, args.cache, sources, dedupe=not args.no_dedupe, ann=args.ann,
+                              workers=args.workers))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import logging
+import re
+import time
+
+import numpy as np
+import pandas as pd
+from rapidfuzz import fuzz
+from rapidfuzz.process import cpdist
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from store.match_keys import normalize_column
+from store.store_loader import WINE_DTYPES
+
+logger = logging.getLogger(__name__)
+
+# only wines agreeing on all of these are ever compared
+BLOCKING_COLUMNS = ('country', 'type', 'variety')
+
+# rows kept in the sliding window of the sorted neighbourhood pass
+DEDUPE_WINDOW = 10
+# minimum similarities (0-100) of normalized winery names and descriptions for a duplicate
+WINERY_THRESHOLD = 90
+DESCRIPTION_THRESHOLD = 90
+
+# vintages in descriptions ('penfolds 2018 grange'), left out of the comparison as years are compared apart
+VINTAGE_REGEX = re.compile(r'\s*\b(?:19|20)\d\d\b')
+# numbers of a description that name the cuvée (bin, lot, cuvée numbers)
+CUVEE_NUMBER_REGEX = re.compile(r'\b\d+\b')
+
+# kept per source on the canonical record, as '<column>_<source>'
+SOURCE_COLUMNS = ('rank', 'price')
+
+
+def dedupe_store(df, window=DEDUPE_WINDOW, winery_threshold=WINERY_THRESHOLD,
+                 description_threshold=DESCRIPTION_THRESHOLD):
+    """
+    Merge the rows describing the same wine, across sources, into one canonical record.
+
+    Rows are blocked on BLOCKING_COLUMNS and sorted within their block by normalized winery, year and
+    description; each row is then compared with the next window - 1 rows only (sorted neighbourhood), so the
+    cost is O(n log n) for the sort plus O(n * window) comparisons. Two rows are duplicates when their years
+    and the cuvée numbers of their descriptions agree, and their normalized winery names and descriptions
+    are similar enough. Duplicates chain into groups,
+    then every row of a group is compared with the group's canonical record and leaves the group unless it is
+    a duplicate of it too, so rows never compared with each other are not merged through a chain.
+
+    The canonical record of a group is its most complete row. The rank and price of every source are kept as
+    '<column>_<source>' attributes (when df has a 'source' column), with 'records' counting the merged rows.
+
+    Args:
+        df: concatenated store frame
+        window: size of the sorted neighbourhood window
+        winery_threshold: minimum fuzz.ratio of the normalized winery names
+        description_threshold: minimum fuzz.token_sort_ratio of the normalized descriptions
+
+    Returns:
+        tuple: (deduplicated frame in the original row order, report dict with the reduction ratio)
+    """
+    start = time.perf_counter()
+    df = df.reset_index(drop=True)
+
+    winery = normalize_column(df['winery']).astype('string').fillna('')
+    description = normalize_column(df['description']).astype('string').fillna('')
+    description = description.str.replace(VINTAGE_REGEX, '', regex=True).str.strip()
+    year = df['year'].astype('Float64').fillna(-1).to_numpy(dtype=np.float64)
+
+    # rows missing a blocking column are never merged
+    blocked = df[list(BLOCKING_COLUMNS)].notna().all(axis=1).to_numpy()
+    block = np.full(len(df), -1, dtype=np.int64)
+    block[blocked] = df.loc[blocked, list(BLOCKING_COLUMNS)].astype('string').groupby(list(BLOCKING_COLUMNS)).ngroup().to_numpy()
+
+    # sorted factorize codes order like the strings themselves
+    order = np.lexsort((pd.factorize(description, sort=True)[0], year, pd.factorize(winery, sort=True)[0], block))
+    winery = winery.to_numpy(dtype=object)
+    numbers = cuvee_numbers(description).to_numpy(dtype=object)
+    description = description.to_numpy(dtype=object)
+    winery_sorted = winery[order]
+    description_sorted = description[order]
+    numbers_sorted = numbers[order]
+
+    left, right = [], []
+    compared = 0
+    for offset in range(1, min(window, len(df))):
+        a, b = order[:-offset], order[offset:]
+        candidates = (block[a] >= 0) & (block[a] == block[b]) & (year[a] == year[b])
+        if not candidates.any():
+            continue
+
+        positions = np.flatnonzero(candidates)
+        compared += len(positions)
+        positions = positions[similar_pairs(winery_sorted, description_sorted, numbers_sorted, positions,
+                                            positions + offset, winery_threshold, description_threshold)]
+
+        left.append(a[positions])
+        right.append(b[positions])
+
+    left = np.concatenate(left) if left else np.empty(0, dtype=np.int64)
+    right = np.concatenate(right) if right else np.empty(0, dtype=np.int64)
+    graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(len(df), len(df)))
+    _, group = connected_components(graph, directed=False)
+
+    # chained rows that are not duplicates of their canonical record become records of their own
+    head = canonical_rows(df, group)
+    members = np.flatnonzero(head != np.arange(len(df)))
+    stray = members[~similar_pairs(winery, description, numbers, members, head[members],
+                                   winery_threshold, description_threshold)]
+    if len(stray):
+        group[stray] = group.max() + 1 + np.arange(len(stray))
+
+    deduped = merge_groups(df, group)
+    report = {
+        'rows': len(df),
+        'canonical_rows': len(deduped),
+        'reduction': 1 - len(deduped) / len(df) if len(df) else 0.0,
+        'compared_pairs': compared,
+        'unchained_rows': len(stray),
+        'seconds': time.perf_counter() - start,
+    }
+    logger.info("dedupe: %d -> %d rows (%.1f%% fewer), %d pairs compared in %.1fs", report['rows'],
+                report['canonical_rows'], report['reduction'] * 100, report['compared_pairs'], report['seconds'])
+    return deduped, report
+
+
+def cuvee_numbers(description):
+    """
+    Cuvée numbers of normalized descriptions, as a sorted space-separated key ('' without any).
+    """
+    return description.str.findall(CUVEE_NUMBER_REGEX).map(lambda numbers: ' '.join(sorted(set(numbers))))
+
+
+def similar_pairs(winery, description, numbers, left, right, winery_threshold=WINERY_THRESHOLD,
+                  description_threshold=DESCRIPTION_THRESHOLD):
+    """
+    Whether the rows at left and right are duplicates: the same cuvée numbers, and similar normalized
+    winery names and descriptions.
+
+    Both scores are symmetric: a description whose words are a subset of the other's is not a duplicate
+    ('penfolds grange shiraz' and 'penfolds shiraz'). Descriptions differing by a number alone score high,
+    so 'penfolds bin 128 shiraz' and 'penfolds bin 138 shiraz' are told apart by their numbers.
+    """
+    similar = np.zeros(len(left), dtype=bool)
+    candidates = np.flatnonzero(numbers[left] == numbers[right])
+    if not len(candidates):
+        return similar
+
+    candidates = candidates[cpdist(winery[left[candidates]], winery[right[candidates]], scorer=fuzz.ratio,
+                                   workers=-1) >= winery_threshold]
+    similar[candidates] = cpdist(description[left[candidates]], description[right[candidates]],
+                                 scorer=fuzz.token_sort_ratio, workers=-1) >= description_threshold
+    return similar
+
+
+def canonical_rows(df, group):
+    """
+    Row of the canonical record of each row's group: its most complete row, the earliest among those.
+    """
+    # most filled store columns first, then the earliest row
+    completeness = df[[column for column in WINE_DTYPES if column in df.columns]].notna().sum(axis=1).to_numpy()
+    ranked = np.lexsort((np.arange(len(df)), -completeness, group))
+    first = ranked[np.r_[True, group[ranked][1:] != group[ranked][:-1]]] if len(df) else ranked
+
+    head = np.empty(group.max() + 1 if len(df) else 0, dtype=np.int64)
+    head[group[first]] = first
+    return head[group]
+
+
+def merge_groups(df, group):
+    """
+    One canonical row per group of duplicates, with the per-source SOURCE_COLUMNS and a 'records' count.
+    """
+    canonical = np.unique(canonical_rows(df, group))
+
+    merged = df.iloc[canonical].reset_index(drop=True)
+    groups = pd.Series(group[canonical])
+    merged['records'] = groups.map(pd.Series(group).value_counts()).to_numpy()
+
+    if 'source' in df.columns:
+        for source in pd.unique(df['source'].dropna()):
+            rows = (df['source'] == source).to_numpy()
+            per_group = df.loc[rows, list(SOURCE_COLUMNS)].groupby(group[rows]).first()
+            for column in SOURCE_COLUMNS:
+                merged[f'{column}_{source}'] = groups.map(per_group[column]).astype(df[column].dtype).to_numpy()
+
+    return merged
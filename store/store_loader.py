@@ -1,13 +1,41 @@
 import glob
-from config.wine import RED_VARIETALS, WHITE_VARIETALS, COUNTRIES
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import config.wine as wine
 import re 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pandas.api.types import union_categoricals
+
+from store.taxonomy import get_taxonomy
+
+logger = logging.getLogger(__name__)
+
+# rows parsed to estimate the memory of a row when sizing stream chunks
+SAMPLE_ROWS = 1000
+# a chunk is held parsed and normalized at once, plus the copies normalize makes
+CHUNK_MEMORY_FACTOR = 4
+# leading hash bits naming the spill buckets of the streaming dedupe, each bucket is deduplicated on its own
+SPILL_BITS = 8
+# a spilled row: the 64-bit hash of its dedupe_key and its position in the stream
+SPILL_RECORD = np.dtype([('hash', '<u8'), ('row', '<i8')])
+# a bucket is held as its records, their sorted copy and the duplicate positions
+SPILL_MEMORY_FACTOR = 3
 
-RED_REGEX = re.compile(r'\b(' + '|'.join(re.escape(varietal.lower()) for varietal in RED_VARIETALS) + r')\b', re.IGNORECASE)
-WHITE_REGEX = re.compile(r'\b(' + '|'.join(re.escape(varietal.lower()) for varietal in WHITE_VARIETALS) + r')\b', re.IGNORECASE)
 YEAR_REGEX = re.compile(r'\b(\d{4})\b')
 
-COUNTRY_PATTERNS = {pattern.lower(): country.lower() for country, data in COUNTRIES.items() for pattern in data['patterns']}
+# groups of derived columns -> config/wine.py settings they are computed from
+TAXONOMY_GROUPS = {
+  'country'     : ('COUNTRIES',),
+  'varietal'    : ('RED_VARIETALS', 'WHITE_VARIETALS'),
+}
 
 WINE_DTYPES = {
   'country'     : 'category',      # categorical for repeated values
@@ -27,17 +55,60 @@ def extract_country(text):
         return
     
     text = text.strip().lower()
+    taxonomy = get_taxonomy()
     
     # ISO search
-    if text in COUNTRIES.keys():
+    if text in taxonomy.countries:
         return text
     
-    # pattern match
-    matches = [country for pattern, country in COUNTRY_PATTERNS.items() if text.startswith(pattern)]
+    # longest pattern the text starts with
+    return taxonomy.country_trie.longest_prefix(text)
+
+
+def map_distinct(values, transform):
+    """
+    Transform each distinct value of a column once and broadcast the results back to the rows through
+    the category codes.
+
+    Args:
+        values (pd.Series): texts (categorical columns are used as is, others are factorized)
+        transform: function of the distinct texts (pd.Series of strings) returning a pd.DataFrame of
+                   categorical columns, one row per distinct text
+
+    Returns:
+        pd.DataFrame: the transformed columns on the index of values, missing where values are missing
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+    else:
+        codes, uniques = pd.factorize(values)
+
+    mapped = transform(pd.Series(uniques, dtype='string'))
+
+    # -1 (missing value) stays -1, i.e. missing in the result
+    return pd.DataFrame({
+        column: pd.Categorical.from_codes(np.append(mapped[column].cat.codes.to_numpy(), -1)[codes],
+                                          dtype=mapped[column].dtype).remove_unused_categories()
+        for column in mapped.columns
+    }, index=values.index)
+
+
+def extract_countries(values):
+    """
+    Column version of extract_country, each distinct value is resolved once (map_distinct).
+
+    Args:
+        values (pd.Series): country texts (categorical columns are used as is, others are factorized)
+
+    Returns:
+        pd.Series: categorical ISO codes (lowercase) on the index of values, missing when unresolved
+    """
+    def resolve(uniques):
+        countries = pd.Series([extract_country(value) for value in uniques], dtype='string')
+        return pd.DataFrame({'country': countries.astype('category')})
+
+    return map_distinct(values, resolve)['country']
 
-    if any(matches): 
-        return matches[0]
-    
 def extract_year(text):
     if not text:
         return
@@ -63,51 +134,355 @@ def extract_varietal(text):
         return None, None
     
     text_str = str(text)
+    taxonomy = get_taxonomy()
     
-    # Search for red varietals
-    red_match = RED_REGEX.search(text_str)
+    # Search for red varietals, then white ones
+    red_match = taxonomy.red_regex.search(text_str)
     if red_match:
-        # Find the original varietal name (with proper casing)
-        matched_varietal = red_match.group(1).lower()
-        for varietal in RED_VARIETALS:
-            if varietal.lower() == matched_varietal:
-                return 'red', varietal
-    
-    # Search for white varietals
-    white_match = WHITE_REGEX.search(text_str)
+        return 'red', taxonomy.red_canonical[red_match.group(1).lower()]
+
+    white_match = taxonomy.white_regex.search(text_str)
     if white_match:
-        # Find the original varietal name (with proper casing)
-        matched_varietal = white_match.group(1).lower()
-        for varietal in WHITE_VARIETALS:
-            if varietal.lower() == matched_varietal:
-                return 'white', varietal
+        return 'white', taxonomy.white_canonical[white_match.group(1).lower()]
     
     # No varietal found
     return None, None
 
+
+def extract_varietals(values):
+    """
+    Column version of extract_varietal, each distinct value is searched once (map_distinct).
+
+    Args:
+        values (pd.Series): texts (categorical columns are used as is, others are factorized)
+
+    Returns:
+        pd.DataFrame: 'type' and 'variety' categorical columns on the index of values,
+                      missing where no varietal was found
+    """
+    def search(uniques):
+        taxonomy = get_taxonomy()
+        red = uniques.str.extract(taxonomy.red_regex, expand=False).str.lower().map(taxonomy.red_canonical)
+        white = uniques.str.extract(taxonomy.white_regex, expand=False).str.lower().map(taxonomy.white_canonical)
+
+        types = pd.Categorical(np.where(red.notna(), 'red', np.where(white.notna(), 'white', None)), categories=['red', 'white'])
+        return pd.DataFrame({'type': types, 'variety': red.combine_first(white).astype('category')})
+
+    return map_distinct(values, search)
+
+
 class StoreLoader:
   """
   Base class for loading wine data.
+
+  Each file is read and normalized on its own (normalize), in a process pool when workers > 1,
+  then the files are concatenated, deduplicated and finalized once (finalize).
   """
 
-  def __init__(self, path_pattern):
+  # columns identifying a row across files once normalized, duplicates are dropped on them (None: all columns)
+  dedupe_key = None
+
+  # finalize needs statistics over all rows (see observe), streaming then reads the files twice
+  two_pass = False
+
+  def __init__(self, path_pattern, chunksize=100_000, workers=1, memory_limit=None):
+    """
+    Args:
+        path_pattern: glob of the review files
+        chunksize: rows parsed at once
+        workers: processes normalizing files in parallel (load only)
+        memory_limit: optional bytes a stream may hold, chunks are sized to it and MemoryError is raised beyond it
+    """
     self.path_pattern = path_pattern
+    self.chunksize = chunksize
+    self.workers = workers
+    self.memory_limit = memory_limit
+    self.peak_memory = 0
 
-  def load(self):
+  def files(self):
     """
-    Load and process wine data.
+    Files matching the path pattern, sorted: glob order depends on the filesystem, and the first row of
+    duplicates is kept, so the order decides the rows and the fingerprint of the store.
     """
     files = glob.glob(self.path_pattern, recursive=True)
     if len(files) == 0:
         raise ValueError(f"No files found matching the pattern {self.path_pattern}")
-    
-    df = pd.read_csv(files[0])
+    return sorted(files)
 
-    for file in files[1:]:
-      df = pd.merge(df, pd.read_csv(file), how='outer')
+  def read_file(self, file, chunksize=None):
+    """
+    Read one file as chunks, text columns of WINE_DTYPES parsed straight into their dtype.
+    """
+    header = pd.read_csv(file, nrows=0).columns
+    dtype = {column: WINE_DTYPES[name] for column in header
+             if (name := column.lower().strip()) in WINE_DTYPES and WINE_DTYPES[name] in ('string', 'category')}
 
-    df.columns = df.columns.str.lower()
-    df.columns = df.columns.str.strip()
+    for chunk in pd.read_csv(file, dtype=dtype, chunksize=chunksize or self.chunksize):
+      chunk.columns = chunk.columns.str.lower()
+      chunk.columns = chunk.columns.str.strip()
+      yield chunk
 
+  def prepare(self, df):
+    """
+    Normalization of the rows of one file that does not depend on the config/wine.py taxonomy,
+    overridden by the source loaders.
+    """
     return df
 
+  def derive(self, df, group):
+    """
+    Columns of a TAXONOMY_GROUPS group derived from a prepared frame, overridden by the source loaders.
+
+    Returns:
+        pd.DataFrame: the derived columns, on the index of df
+    """
+    return pd.DataFrame(index=df.index)
+
+  def normalize(self, df):
+    """
+    Normalize the rows of one file: prepare them, then add the taxonomy derived columns.
+    """
+    df = self.prepare(df)
+    derived = [self.derive(df, group) for group in TAXONOMY_GROUPS]
+    for columns in derived:
+      df[list(columns.columns)] = columns
+    return df
+
+  def observe(self, df, stats):
+    """
+    Fold a normalized chunk into the statistics finalize needs when streaming (first pass of two_pass loaders).
+    """
+    return stats
+
+  def finalize(self, df, stats=None):
+    """
+    Processing needing all files at once (e.g. global scaling), overridden by the source loaders.
+
+    Args:
+        df: all rows when loading, one chunk when streaming
+        stats: statistics gathered by observe when streaming, None when df holds all rows
+    """
+    return df
+
+  def load_file(self, file):
+    """
+    Read and normalize one file.
+    """
+    return self.normalize(concat_frames(list(self.read_file(file))))
+
+  def load(self):
+    """
+    Load and process wine data.
+    """
+    files = self.files()
+
+    if self.workers > 1 and len(files) > 1:
+      # workers ship Arrow tables back, far cheaper to pickle than frames of Python strings
+      with ProcessPoolExecutor(max_workers=min(self.workers, len(files))) as pool:
+        frames = [table_frame(*result) for result in pool.map(self._load_table, files)]
+    else:
+      frames = [self.load_file(file) for file in files]
+
+    held = sum(frame.memory_usage(deep=True).sum() for frame in frames)
+    df = concat_frames(frames)
+    del frames
+
+    self.peak_memory = int(held + df.memory_usage(deep=True).sum())
+
+    # typed after finalize, like the streamed chunks, as finalize may add WINE_DTYPES columns
+    df = self.finish(df)
+    df = df.astype({column: dtype for column, dtype in WINE_DTYPES.items() if column in df.columns})
+    logger.info("%s: %d rows from %d files, peak memory ~%.1f MB", self.path_pattern, len(df), len(files), self.peak_memory / 2**20)
+
+    return df
+
+  def finish(self, df):
+    """
+    Deduplicate and finalize the concatenated normalized rows of all files.
+    """
+    df = df.drop_duplicates(subset=self.dedupe_key, ignore_index=True)
+    return self.finalize(df)
+
+  def _load_table(self, file):
+    df = self.load_file(file)
+    return pa.Table.from_pandas(df, preserve_index=False), df.dtypes.to_dict()
+
+  def stream(self):
+    """
+    Out-of-core load: yield normalized, typed and finalized chunks, never holding more than one chunk.
+
+    A first pass spills a 64-bit hash of the dedupe_key of every row to disk, in buckets by hash prefix,
+    and finds the positions of the duplicates one bucket at a time; the next passes drop them, so the
+    result holds the same rows as load while the memory held does not grow with the rows read.
+    """
+    with tempfile.TemporaryDirectory(prefix='cellar-stream-') as spill:
+      duplicates = self._duplicate_rows(spill)
+
+      stats = None
+      if self.two_pass:
+        for df in self._normalized_chunks(duplicates):
+          stats = self.observe(df, stats)
+
+      for df in self._normalized_chunks(duplicates):
+        df = self.finalize(df, stats)
+        yield df.astype({column: dtype for column, dtype in WINE_DTYPES.items() if column in df.columns})
+
+  def stream_to(self, path, partition_by=('country',)):
+    """
+    Stream the files into a partitioned Arrow IPC dataset (hive layout, e.g. path/country=fra/part-0-0.arrow),
+    readable with pyarrow.dataset.dataset(path, format='feather', partitioning='hive').
+
+    The dataset is written to a staging directory next to path and only replaces path once complete.
+
+    Args:
+        path: output directory, replaced when it exists
+        partition_by: columns partitioning the files
+
+    Returns:
+        int: rows written
+    """
+    parent, name = os.path.split(os.path.abspath(path))
+    staging = os.path.join(parent, f'.{name}.tmp')
+    shutil.rmtree(staging, ignore_errors=True)
+
+    rows = 0
+    try:
+      for i, df in enumerate(self.stream()):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        for column in partition_by:
+          # partition values are plain strings in the paths
+          table = table.set_column(table.schema.get_field_index(column), column, table[column].cast(pa.string()))
+
+        ds.write_dataset(table, staging, format='feather', partitioning=list(partition_by), partitioning_flavor='hive',
+                         basename_template=f'part-{i}-{{i}}.arrow', existing_data_behavior='overwrite_or_ignore')
+        rows += len(df)
+      os.makedirs(staging, exist_ok=True)
+    except BaseException:
+      shutil.rmtree(staging, ignore_errors=True)
+      raise
+
+    if os.path.isdir(path):
+      replaced = os.path.join(parent, f'.{name}.old')
+      shutil.rmtree(replaced, ignore_errors=True)
+      os.replace(path, replaced)
+      os.replace(staging, path)
+      shutil.rmtree(replaced)
+    else:
+      os.replace(staging, path)
+
+    logger.info("%s: %d rows streamed to %s, peak memory ~%.1f MB", self.path_pattern, rows, path, self.peak_memory / 2**20)
+    return rows
+
+  def _chunks(self):
+    # normalized chunks of all files, with the memory of the parsed chunk, in the same chunks on every pass
+    for file in self.files():
+      for chunk in self.read_file(file, self._stream_chunksize(file)):
+        held = chunk.memory_usage(deep=True).sum()
+        df = self.normalize(chunk)
+        del chunk
+        yield file, df, held
+
+  def _duplicate_rows(self, spill):
+    """
+    Stream positions of the rows duplicating an earlier row, as sorted memory-mapped arrays (one per bucket).
+    """
+    self.peak_memory = 0
+    position = 0
+    for file, df, held in self._chunks():
+      records = np.empty(len(df), dtype=SPILL_RECORD)
+      records['hash'] = pd.util.hash_pandas_object(df[self.dedupe_key] if self.dedupe_key else df, index=False).to_numpy()
+      records['row'] = np.arange(position, position + len(df))
+      position += len(df)
+      self._hold(held + df.memory_usage(deep=True).sum() + 2 * records.nbytes, file)
+      del df
+
+      bucket = records['hash'] >> np.uint64(64 - SPILL_BITS)
+      order = np.argsort(bucket, kind='stable')
+      records, bucket = records[order], bucket[order]
+      bounds = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1], True])
+      for start, stop in zip(bounds[:-1], bounds[1:]):
+        with open(os.path.join(spill, f'{int(bucket[start]):03x}.bin'), 'ab') as f:
+          records[start:stop].tofile(f)
+
+    duplicates = []
+    for name in sorted(os.listdir(spill)):
+      path = os.path.join(spill, name)
+      records = np.fromfile(path, dtype=SPILL_RECORD)
+      os.remove(path)
+      self._hold(SPILL_MEMORY_FACTOR * records.nbytes, path)
+
+      # the first row of each hash is kept, like drop_duplicates
+      records.sort(order=('hash', 'row'))
+      rows = np.sort(records['row'][np.r_[False, records['hash'][1:] == records['hash'][:-1]]])
+      if len(rows):
+        np.save(f'{path}.npy', rows)
+        duplicates.append(np.load(f'{path}.npy', mmap_mode='r'))
+
+    return duplicates
+
+  def _normalized_chunks(self, duplicates):
+    position = 0
+    for file, df, held in self._chunks():
+      keep = np.ones(len(df), dtype=bool)
+      for rows in duplicates:
+        start, stop = rows.searchsorted([position, position + len(df)])
+        keep[rows[start:stop] - position] = False
+      position += len(df)
+
+      df = df[keep]
+      self._hold(held + df.memory_usage(deep=True).sum(), file)
+      yield df
+
+  def _hold(self, held, source):
+    self.peak_memory = max(self.peak_memory, int(held))
+    if self.memory_limit is not None and held > self.memory_limit:
+      raise MemoryError(f"Streaming {source} holds ~{held / 2**20:.1f} MB, above the {self.memory_limit / 2**20:.1f} MB limit")
+
+  def _stream_chunksize(self, file):
+    """
+    Rows per chunk keeping a chunk and its copies under memory_limit.
+    """
+    if self.memory_limit is None:
+      return self.chunksize
+
+    sample = next(self.read_file(file, SAMPLE_ROWS), None)
+    if sample is None or len(sample) == 0:
+      return self.chunksize
+
+    row_bytes = sample.memory_usage(deep=True).sum() / len(sample) * CHUNK_MEMORY_FACTOR
+    return max(1, min(self.chunksize, int(self.memory_limit / 2 / row_bytes)))
+
+
+def taxonomy_fingerprints():
+  """
+  Content hash of the config/wine.py settings of each TAXONOMY_GROUPS group, to tell which derived columns are stale.
+  """
+  return {group: hashlib.sha1(json.dumps([getattr(wine, name) for name in names], sort_keys=True).encode()).hexdigest()
+          for group, names in TAXONOMY_GROUPS.items()}
+
+
+def table_frame(table, dtypes):
+  """
+  Frame of an Arrow table shipped by a worker, with the dtypes of the frame it was made from
+  (Arrow does not keep the string dtype of categories nor the missing value of strings).
+  """
+  return table.to_pandas().astype(dtypes)
+
+
+def concat_frames(frames):
+  """
+  Concatenate frames once, keeping categoricals (their categories are aligned first).
+  """
+  for column in {column for frame in frames for column in frame.select_dtypes('category').columns}:
+    values = [frame[column] for frame in frames
+              if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype)]
+    if len({str(series.cat.categories.dtype) for series in values}) > 1:
+      # str and string categories (parsed vs. derived vs. read back) only union as objects
+      values = [series.cat.rename_categories(series.cat.categories.astype(object)) for series in values]
+
+    categories = union_categoricals(values).categories
+    for frame in frames:
+      if column in frame.columns and isinstance(frame[column].dtype, pd.CategoricalDtype):
+        frame[column] = frame[column].cat.set_categories(categories)
+
+  return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,99 @@
+import hashlib
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from store.match_keys import KEY_COLUMNS, key_column
+from store.store_loader import WINE_DTYPES
+
+# schema metadata keys
+FINGERPRINT_KEY = b'cellar.fingerprint'
+SORTED_BY_KEY = b'cellar.sorted_by'
+
+# in-memory store representation: repeated texts dictionary-encoded (each distinct value stored once, rows
+# hold integer codes), mostly unique texts in one contiguous Arrow UTF-8 buffer with offsets
+COMPACT_DTYPES = {
+    'winery': 'category',
+    'region': 'category',
+    'description': pd.StringDtype('pyarrow'),
+    **{key_column(column): 'category' for column in KEY_COLUMNS},
+    key_column('description'): pd.StringDtype('pyarrow'),
+}
+
+
+def frame_fingerprint(df):
+    """
+    Content hash of a store frame (values only, row order sensitive).
+    """
+    return hashlib.sha1(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def write_store_table(df, path, sort_by=None):
+    """
+    Write a store frame as an uncompressed Arrow IPC (Feather v2) file, which can be memory-mapped.
+
+    Columns of WINE_DTYPES keep their dtypes, COMPACT_DTYPES categoricals are stored dictionary-encoded.
+
+    Args:
+        df: store frame
+        path: destination file
+        sort_by: optional columns to sort rows by, recorded so readers can skip sorting
+
+    Returns:
+        str: content fingerprint stored in the file
+    """
+    df = compact_frame(df.astype({column: dtype for column, dtype in WINE_DTYPES.items() if column in df.columns}))
+    if sort_by:
+        df = df.sort_values(list(sort_by), kind='stable')
+
+    fingerprint = frame_fingerprint(df)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({
+        **table.schema.metadata,
+        FINGERPRINT_KEY: fingerprint.encode(),
+        SORTED_BY_KEY: json.dumps(list(sort_by or [])).encode(),
+    })
+
+    feather.write_feather(table, path, compression='uncompressed')
+    return fingerprint
+
+
+def open_store_table(path):
+    """
+    Memory-map a store table written by write_store_table; no column is read until accessed.
+
+    Returns:
+        tuple: (pa.Table, fingerprint, sorted_by columns)
+    """
+    table = feather.read_table(path, memory_map=True)
+    metadata = table.schema.metadata or {}
+
+    fingerprint = metadata.get(FINGERPRINT_KEY, b'').decode() or None
+    sorted_by = json.loads(metadata.get(SORTED_BY_KEY, b'[]'))
+    return table, fingerprint, sorted_by
+
+
+def compact_frame(df):
+    """
+    Cast the COMPACT_DTYPES columns of a store frame; values are unchanged.
+    """
+    return df.astype({column: dtype for column, dtype in COMPACT_DTYPES.items()
+                      if column in df.columns and df[column].dtype != dtype})
+
+
+def frame_memory(df):
+    """
+    Bytes held by each column of a frame, including the strings and dictionaries it references.
+    """
+    return {column: int(size) for column, size in df.memory_usage(deep=True, index=False).items()}
+
+
+def table_to_frame(table, columns):
+    """
+    Project table columns to a pandas frame, strings stay Arrow-backed so no Python objects are built.
+    """
+    columns = [column for column in columns if column in table.column_names]
+    return table.select(columns).to_pandas(types_mapper={pa.string(): pd.StringDtype('pyarrow'),
+                                                         pa.large_string(): pd.StringDtype('pyarrow')}.get)
@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+
+import config.wine as wine
+from store.aho_corasick import AhoCorasick
+from store.deletion_index import DeletionIndex
+from store.prefix_trie import PrefixTrie
+
+logger = logging.getLogger(__name__)
+
+# bump when CompiledTaxonomy changes, cached taxonomies of other versions are ignored
+TAXONOMY_VERSION = 4
+
+# largest edit distance the fuzzy term lookups answer
+TERM_EDIT_DISTANCE = 2
+
+# where compiled taxonomies are pickled, one file per config/wine.py content
+TAXONOMY_CACHE_DIR = os.environ.get('CELLAR_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'cellar'))
+
+_taxonomy = None
+
+
+def alternation_regex(terms, longest_first=False):
+    """
+    Case-insensitive regex matching any of the terms as whole words, captured as group 1.
+
+    At a given position the first listed term that matches wins, so longest_first prefers 'pinot noir' over 'pinot'.
+    """
+    terms = sorted(terms, key=len, reverse=True) if longest_first else list(terms)
+    return re.compile(r'\b(' + '|'.join(re.escape(term.lower()) for term in terms) + r')\b', re.IGNORECASE)
+
+
+def canonical_names(names):
+    """
+    Lowercased name -> name as listed, the first listed spelling wins.
+    """
+    canonical = {}
+    for name in names:
+        canonical.setdefault(name.lower(), name)
+    return canonical
+
+
+def span_key(text):
+    """
+    Text as the span automaton matches it: lowercase, hyphens as spaces, single spaces.
+    """
+    return ' '.join(text.lower().replace('-', ' ').split())
+
+
+class CompiledTaxonomy:
+    """
+    Lookup structures of a wine taxonomy, built once: hash sets and canonical-name maps for token lookups,
+    alternation regexes for searches in text, a prefix trie of the country names, an automaton of all
+    the terms for the multi-word spans of OCR lines and a deletion index of the terms for misread tokens.
+
+    All keys are lowercase, country codes are lowercased ISO codes ('aus').
+    """
+
+    def __init__(self, red_varietals, white_varietals, varietal_abbreviations, countries, fingerprint=None):
+        self.fingerprint = fingerprint
+
+        # varietals
+        self.red_canonical = canonical_names(red_varietals)
+        self.white_canonical = canonical_names(white_varietals)
+        self.red_varietals = frozenset(self.red_canonical)
+        self.white_varietals = frozenset(self.white_canonical)
+        self.varietal_abbreviations = {abbreviation.lower(): varietal.lower() for abbreviation, varietal in varietal_abbreviations.items()}
+
+        # listed order, the store extraction has always preferred the first listed varietal at a position
+        self.red_regex = alternation_regex(red_varietals)
+        self.white_regex = alternation_regex(white_varietals)
+
+        # countries
+        self.countries = frozenset(code.lower() for code in countries)
+        self.country_patterns = {pattern.lower(): code.lower() for code, data in countries.items() for pattern in data['patterns']}
+        self.country_regions = {region.lower(): code.lower() for code, data in countries.items() for region in data['regions']}
+        self.country_trie = PrefixTrie(self.country_patterns)
+        self.region_regex = alternation_regex(self.country_regions, longest_first=True)
+
+        # span key -> term, a key shared by several terms keeps the one the token classification checks first
+        terms = {}
+        for term in (*self.country_regions, *self.country_patterns, *self.varietal_abbreviations,
+                     *self.red_canonical, *self.white_canonical):
+            terms.setdefault(span_key(term), term)
+        self.term_automaton = AhoCorasick(terms)
+        # country patterns are mostly everyday words ('greek', 'french'), never corrected into
+        self.term_index = DeletionIndex((*self.country_regions, *self.varietal_abbreviations, *self.red_canonical,
+                                         *self.white_canonical), TERM_EDIT_DISTANCE)
+
+    @classmethod
+    def from_config(cls, fingerprint=None):
+        return cls(wine.RED_VARIETALS, wine.WHITE_VARIETALS, wine.VARIETAL_ABBREVIATIONS, wine.COUNTRIES,
+                   fingerprint or config_fingerprint())
+
+
+def config_fingerprint():
+    """
+    Content hash of config/wine.py (and of TAXONOMY_VERSION).
+    """
+    with open(wine.__file__, 'rb') as f:
+        return hashlib.sha1(f.read() + f':{TAXONOMY_VERSION}'.encode()).hexdigest()
+
+
+def get_taxonomy():
+    """
+    Compiled taxonomy of config/wine.py, loaded on first use and shared by the whole process.
+    """
+    global _taxonomy
+    if _taxonomy is None:
+        _taxonomy = load_taxonomy()
+    return _taxonomy
+
+
+def load_taxonomy(cache_dir=TAXONOMY_CACHE_DIR):
+    """
+    Compiled taxonomy of config/wine.py, read from the disk cache, or compiled and cached when
+    config/wine.py changed since.
+    """
+    fingerprint = config_fingerprint()
+    path = os.path.join(cache_dir, f'taxonomy-{fingerprint}.pkl')
+
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, AttributeError, pickle.UnpicklingError) as e:
+            logger.warning("Ignoring unreadable taxonomy cache %s: %s", path, e)
+
+    taxonomy = CompiledTaxonomy.from_config(fingerprint)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(f'{path}.tmp', 'wb') as f:
+            pickle.dump(taxonomy, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{path}.tmp', path)
+    except OSError as e:
+        logger.warning("Could not cache the taxonomy in %s: %s", cache_dir, e)
+
+    return taxonomy
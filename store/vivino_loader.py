@@ -1,23 +1,28 @@
 
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
-from store.store_loader import WINE_DTYPES, StoreLoader, extract_country, extract_varietal, extract_year
+from store.store_loader import WINE_DTYPES, StoreLoader, extract_countries, extract_varietals, extract_year
 
 class VivinoLoader(StoreLoader):
     """
     Class to load and process Vivino wine data.
     """   
 
-    def __init__(self, path_pattern):
-        super().__init__(path_pattern)
+    # the same wine vintage shows up on several scraped pages
+    dedupe_key = ['wine id', 'year']
 
-    def load(self):
+    # rank scaling needs the rating range of all files
+    two_pass = True
+
+    def __init__(self, path_pattern, chunksize=100_000, workers=1, memory_limit=None):
+        super().__init__(path_pattern, chunksize, workers, memory_limit)
+
+    def prepare(self, df):
         """
-        Load and process Vivino wine data.
+        Process one Vivino file.
         """
 
-        df = super().load()
-
         # winery          object
         # year            object
         # wine id          int64
@@ -34,22 +39,46 @@ class VivinoLoader(StoreLoader):
         # df = df.dropna(subset=['year'])
         df['year'] = df['year'].astype('Int16')
 
-        # Type and varietal
         df = df.rename(columns={'wine': 'description'})
         df = df.dropna(subset=['description', 'country'])
 
-        df[['type', 'variety']] = pd.DataFrame(df['description'].apply(extract_varietal).tolist(), index=df.index)
-
-        # Country
-        df['country'] = df['country'].apply(lambda x: extract_country(x) if pd.notna(x) else None).astype('string')
-
         # Cleanup / types
         str_cols = [k for k, v in WINE_DTYPES.items() if v == 'string']
         df[str_cols] = df[str_cols].astype('string')
+
+        return df
+
+    def derive(self, df, group):
+        """
+        Country, or type and varietal of the wine name.
+        """
+        if group == 'country':
+            return extract_countries(df['country']).to_frame('country')
+        if group == 'varietal':
+            return extract_varietals(df['description'])
+        return super().derive(df, group)
+
+    def observe(self, df, stats):
+        """
+        Rating range of a chunk, merged into the range of the chunks seen so far.
+        """
+        low, high = df['rating'].min(), df['rating'].max()
+        if stats is not None:
+            low, high = np.fmin(stats['rating_min'], low), np.fmax(stats['rating_max'], high)
+        return {'rating_min': low, 'rating_max': high}
+
+    def finalize(self, df, stats=None):
+        """
+        Rank scaling, over all Vivino files.
+        """
         df = df.drop('wine id', axis=1)
 
-        # Rank
+        # Rank, a MinMaxScaler only keeps the range, so fitting it on the streamed range is exact
         scaler = MinMaxScaler()
-        df['rank'] = scaler.fit_transform(df[['rating']])
+        if stats is None:
+            scaler.fit(df[['rating']])
+        else:
+            scaler.fit(pd.DataFrame({'rating': [stats['rating_min'], stats['rating_max']]}))
+        df['rank'] = scaler.transform(df[['rating']])
 
         return df
\ No newline at end of file
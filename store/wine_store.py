@@ -1,71 +1,555 @@
+import json
+import logging
+import os
+import sys
+
 from fuzzywuzzy import fuzz
+import numpy as np
 import pandas as pd
+from store.match_keys import KEY_COLUMNS, add_match_keys, key_column, normalize_entry, normalize_key
+from store.match_scorer import CandidateBlock, score_block, top_k_block
+from store.ngram_index import NgramIndex, file_fingerprint
 from store.store_loader import WINE_DTYPES 
+from store.store_table import compact_frame, frame_memory, open_store_table, table_to_frame, write_store_table
+
+logger = logging.getLogger(__name__)
+
+# store rows are sorted by these columns, so every key prefix is a contiguous row range
+PARTITION_COLUMNS = ('country', 'type', 'variety', 'year')
+
+# how large partitions are narrowed before full scoring
+CANDIDATE_MODES = ('exact', 'ngram', 'ann')
+
+# normalized key columns looked up before any fuzzy scoring, (menu key, ...) -> store columns
+EXACT_KEYS = {
+    'winery': ('winery_key', 'variety_key', 'year'),
+    'description': ('description_key', 'year'),
+}
+
+# memory-mapped Arrow store tables, anything else is read as CSV
+TABLE_SUFFIXES = ('.arrow', '.feather')
+
+# versioned store directories (store.store_build.build_store_dir): root/CURRENT names the current root/<version>
+STORE_FORMAT = 1
+STORE_TABLE = 'store.arrow'
+STORE_LOOKUPS = 'lookups.json'
+STORE_METADATA = 'metadata.json'
+STORE_CURRENT = 'CURRENT'
+
+
+def build_store_table(csv_path, path):
+    """
+    Convert a master store CSV into a memory-mappable store table, pre-sorted by partition.
+
+    Returns:
+        str: fingerprint of the written table
+    """
+    df = add_match_keys(pd.read_csv(csv_path, dtype=WINE_DTYPES))
+    return write_store_table(df, path, sort_by=PARTITION_COLUMNS)
+
+
+def write_current(root, version):
+    """
+    Point root/CURRENT at a store version, atomically so readers never see a partial name.
+    """
+    path = os.path.join(root, STORE_CURRENT)
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(version)
+    os.replace(f'{path}.tmp', path)
+
+
+def resolve_store_dir(path):
+    """
+    Version directory of a store path: the path itself when it holds STORE_METADATA, else root/CURRENT.
+    """
+    if os.path.exists(os.path.join(path, STORE_METADATA)):
+        return path
+
+    current = os.path.join(path, STORE_CURRENT)
+    if not os.path.exists(current):
+        raise FileNotFoundError(f"{path} is neither a store version nor a store root with a {STORE_CURRENT} file")
+
+    with open(current) as f:
+        return os.path.join(path, f.read().strip())
+
+
+def _json_key(key):
+    return [value.item() if isinstance(value, np.generic) else value for value in key]
+
 
 class WineStore:
     """
     Class to load and process Vivino wine data.
     """   
 
-    def __init__(self, path):
+    def __init__(self, path, candidate_limit=500, partition_depth=2, candidate_mode='ngram', cache=None):
+        """
+        Args:
+            path: store CSV, store table (.arrow / .feather) written by build_store_table,
+                  or store directory written by store.store_build.build_store_dir (a version, or the root of the versions)
+            candidate_limit: partitions larger than this are narrowed to this many candidates
+            partition_depth: number of PARTITION_COLUMNS keyed in the partition map and narrowing the partition of entries
+                  having them, from 2 (country, type) to 4 (+ variety, year)
+            candidate_mode: one of CANDIDATE_MODES - score whole partitions, or narrow them with the n-gram index or the FAISS index
+            cache: optional store.match_cache.MatchCache, keyed by store fingerprint and retrieval settings so a rebuilt
+                  or differently configured store never reads another's matches
+        """
+        if candidate_mode not in CANDIDATE_MODES:
+            raise ValueError(f"Invalid candidate mode: {candidate_mode}")
+
         self.path = path
+        self.candidate_limit = candidate_limit
+        self.partition_depth = partition_depth
+        self.candidate_mode = candidate_mode
+        self.cache = cache
         self.db = None
+        self.table = None
+        self.index = None
+        self.ann_index = None
+        self.table_path = None
+        self.save_indexes = False
+        self.fingerprint = None
+        self.metadata = None
+        self.partitions = {}
+        self.partition_values = {}
+        self.exact_index = {}
 
     def load(self):
-        self.db = pd.read_csv(self.path, dtype=WINE_DTYPES)
+        store_dir = resolve_store_dir(self.path) if os.path.isdir(self.path) else None
+        table_path = self.path
+        if store_dir is not None:
+            with open(os.path.join(store_dir, STORE_METADATA)) as f:
+                self.metadata = json.load(f)
+            if self.metadata.get('format') != STORE_FORMAT:
+                raise ValueError(f"Unsupported store format {self.metadata.get('format')} in {store_dir}")
+            table_path = os.path.join(store_dir, STORE_TABLE)
+
+        if table_path.endswith(TABLE_SUFFIXES):
+            # only the WINE_DTYPES columns are materialized, the others stay in the mapped file
+            self.table, self.fingerprint, sorted_by = open_store_table(table_path)
+            db = table_to_frame(self.table, [*WINE_DTYPES, *map(key_column, KEY_COLUMNS)])
+        else:
+            self.table, self.fingerprint, sorted_by = None, None, []
+            db = pd.read_csv(table_path, dtype=WINE_DTYPES)
+
+        if self.metadata is not None and self.metadata['fingerprint'] != self.fingerprint:
+            raise ValueError(f"Store table of {store_dir} does not match its metadata fingerprint")
+
+        if list(sorted_by) != list(PARTITION_COLUMNS):
+            db = db.sort_values(list(PARTITION_COLUMNS), kind='stable')
+
+        # normalized match keys, precomputed in store tables
+        self.db = compact_frame(add_match_keys(db))
+        self.fingerprint = self.fingerprint or file_fingerprint(table_path)
+        if store_dir is None or not self._open_lookups(store_dir):
+            self.partitions = self._build_partitions()
+            self.exact_index = self._build_exact_index()
+
+        # menu entries carry normalized keys, the partition map the stored values
+        self.partition_values = {column: {normalize_key(value): value for value in self.db[column].dropna().unique()}
+                                 for column in PARTITION_COLUMNS[2:self.partition_depth] if column in KEY_COLUMNS}
+
+        # versions are never modified once written, a loose store table keeps its indexes next to it
+        self.table_path = table_path
+        self.save_indexes = store_dir is None
+        if self.candidate_mode != 'exact':
+            self.load_index(self.candidate_mode)
+
+        stats = self.partition_stats()
+        logger.debug("%d partitions over %d wines, largest %d rows, map ~%d bytes",
+                     stats['partitions'], len(self.db), stats['max_rows'], stats['bytes'])
+
+    def load_index(self, mode):
+        """
+        Open the candidate index of a mode ('ngram' or 'ann') persisted next to the store table, or build it.
+
+        A built index is saved next to a store table, except in store versions, which are never modified;
+        where it cannot be saved (a read-only location) it is only kept in memory.
+        """
+        if mode == 'ann':
+            from store.ann_index import AnnIndex
+            index_class, suffix = AnnIndex, '.faiss'
+        else:
+            index_class, suffix = NgramIndex, '.ngram.npz'
+
+        path = f'{self.table_path}{suffix}'
+        index = index_class.open(path, self.fingerprint)
+        if index is None:
+            index = index_class.build(self.db, fingerprint=self.fingerprint)
+            if self.save_indexes:
+                try:
+                    index.save(path)
+                except (OSError, RuntimeError) as e:
+                    # faiss reports write errors as RuntimeError
+                    logger.warning("Keeping the %s index in memory, could not save %s: %s", mode, path, e)
+
+        if mode == 'ann':
+            self.ann_index = index
+        else:
+            self.index = index
+        return index
+
+    def save_lookups(self, directory):
+        """
+        Persist the partition map and the exact lookup maps into a store directory (STORE_LOOKUPS).
+        """
+        lookups = {
+            'fingerprint': self.fingerprint,
+            'partition_depth': self.partition_depth,
+            'partitions': [[_json_key(key), rows.start, rows.stop] for key, rows in self.partitions.items()],
+            'exact': {name: [[*_json_key(key), row] for key, row in index.items()] for name, index in self.exact_index.items()},
+        }
+        with open(os.path.join(directory, STORE_LOOKUPS), 'w') as f:
+            json.dump(lookups, f)
+
+    def _open_lookups(self, directory):
+        """
+        Read the partition and exact lookup maps of a store directory, False when they are missing or do not fit.
+        """
+        path = os.path.join(directory, STORE_LOOKUPS)
+        if not os.path.exists(path):
+            return False
+
+        with open(path) as f:
+            lookups = json.load(f)
+        if lookups['fingerprint'] != self.fingerprint or lookups['partition_depth'] < self.partition_depth:
+            return False
+
+        self.partitions = {tuple(key): slice(start, stop) for key, start, stop in lookups['partitions']
+                           if len(key) <= self.partition_depth}
+        self.exact_index = {name: {tuple(entry[:-1]): entry[-1] for entry in entries}
+                            for name, entries in lookups['exact'].items()}
+        return True
+
+    def column(self, name):
+        """
+        A store column aligned with self.db; columns left in the store table are read on first access.
+        """
+        if name not in self.db.columns:
+            if self.table is None or name not in self.table.column_names:
+                raise KeyError(name)
+
+            # self.db keeps the table row numbers as index
+            values = table_to_frame(self.table, [name])[name]
+            self.db[name] = values.take(self.db.index.to_numpy()).set_axis(self.db.index)
+
+        return self.db[name]
+
+    def _build_partitions(self):
+        """
+        Map every (country, type[, variety[, year]]) key to its contiguous row range of the sorted store.
+        """
+        partitions = {}
+        for depth in range(2, self.partition_depth + 1):
+            groups = self.db.groupby(list(PARTITION_COLUMNS[:depth]), observed=True, sort=False).indices
+            for key, rows in groups.items():
+                partitions[key] = slice(int(rows[0]), int(rows[-1]) + 1)
+
+        return partitions
+
+    def _build_exact_index(self):
+        """
+        Hash maps of EXACT_KEYS values to the row position of the single wine having them;
+        keys shared by several wines are left out and go through fuzzy scoring.
+        """
+        exact_index = {}
+        for name, columns in EXACT_KEYS.items():
+            groups = self.db.groupby(list(columns), observed=True, sort=False).indices
+            exact_index[name] = {key: int(rows[0]) for key, rows in groups.items() if len(rows) == 1}
+
+        return exact_index
+
+    def partition(self, *key):
+        """
+        Row range of a partition key, an empty range when the key is unknown.
+        """
+        return self.partitions.get(key, slice(0, 0))
+
+    def partition_stats(self):
+        """
+        Partition count, size spread (rows) and memory overhead (bytes) of the partition map.
+        """
+        sizes = np.array([rows.stop - rows.start for key, rows in self.partitions.items() if len(key) == 2])
+        overhead = sys.getsizeof(self.partitions) + sum(sys.getsizeof(key) + sys.getsizeof(rows) for key, rows in self.partitions.items())
 
-    def retrieve_wine(self, menu_entry):
+        return {
+            'partitions': len(self.partitions),
+            'min_rows': int(sizes.min()) if len(sizes) else 0,
+            'median_rows': float(np.median(sizes)) if len(sizes) else 0.0,
+            'max_rows': int(sizes.max()) if len(sizes) else 0,
+            'bytes': overhead,
+        }
+
+    def memory_report(self):
+        """
+        Approximate bytes held by the loaded store: per frame column, and per lookup structure.
+
+        Columns of a memory-mapped store table count their Arrow buffers, which the OS pages in from the file.
+
+        Returns:
+            dict: 'columns' (column -> bytes), 'frame', 'partitions', 'exact_index', 'ngram_index', 'ann_index' and 'total' bytes
+        """
+        if self.db is None:
+            raise ValueError("Database not loaded. Call load() first.")
+
+        columns = frame_memory(self.db)
+        report = {
+            'columns': columns,
+            'frame': sum(columns.values()) + int(self.db.index.memory_usage(deep=True)),
+            'partitions': self.partition_stats()['bytes'],
+            'exact_index': sum(sys.getsizeof(index) + sum(sys.getsizeof(key) for key in index)
+                               for index in self.exact_index.values()),
+            'ngram_index': 0 if self.index is None else int(self.index.grams.nbytes + self.index.offsets.nbytes + self.index.postings.nbytes
+                                                            + sys.getsizeof(self.index.vocabulary)),
+            'ann_index': 0 if self.ann_index is None else int(self.ann_index.index.ntotal * self.ann_index.index.d * 4),
+        }
+        report['total'] = report['frame'] + report['partitions'] + report['exact_index'] + report['ngram_index'] + report['ann_index']
+        return report
+
+    def retrieve_wine(self, menu_entry, return_path=False):
         """
         Find the best matching wine from database for a menu entry.
         
         Args:
             menu_entry: dict with keys like 'text', 'year', 'region', 'country', 'variety'
+            return_path: also return which path answered, 'exact' (normalized key hit) or 'fuzzy'
         
         Returns:
-            tuple: (best_match_row, best_score)
+            tuple: (best_match_row, best_score), or (best_match_row, best_score, path) with return_path
+        """
+        return self.retrieve_many([menu_entry], return_path)[0]
+
+    def retrieve_many(self, menu_entries, return_path=False):
+        """
+        Find the best matching wine for every entry of a menu.
+
+        Entries with a unique exact normalized-key hit are answered right away. The others are
+        grouped by blocking key, identical entries are scored once, and all entries of a partition
+        are scored together against one candidate block.
+
+        Args:
+            menu_entries: list of menu entry dicts, as accepted by retrieve_wine
+            return_path: also return which path answered each entry, as retrieve_wine
+
+        Returns:
+            list: (best_match_row, best_score[, path]) per entry, in input order
+        """
+        if self.db is None:
+            raise ValueError("Database not loaded. Call load() first.")
+
+        menu_entries = [normalize_entry(menu_entry) for menu_entry in menu_entries]
+        entry_keys = [self._entry_key(menu_entry) for menu_entry in menu_entries]
+
+        # entry key -> (row position, score, path)
+        matches = {}
+        # entry key -> (entry, row position) of exact hits
+        exact = {}
+        # blocking key -> {entry key -> entry}
+        blocks = {}
+
+        seen = set()
+        for menu_entry, entry_key in zip(menu_entries, entry_keys):
+            # identical entries are looked up once, whichever path answers them
+            if entry_key in seen:
+                continue
+            seen.add(entry_key)
+
+            cached = None if self.cache is None else self.cache.get(self._cache_key(entry_key))
+            if cached is not None:
+                matches[entry_key] = cached
+                continue
+
+            row = self._exact_row(menu_entry)
+            key = self._blocking_key(menu_entry)
+            if row is not None:
+                exact[entry_key] = (menu_entry, row)
+            elif key is not None:
+                blocks.setdefault(key, {})[entry_key] = menu_entry
+            else:
+                matches[entry_key] = (None, 0, None)
+
+        cached = len(matches)
+
+        if exact:
+            rows = [row for _, row in exact.values()]
+            block = CandidateBlock(self.db.iloc[rows])
+            for i, (entry_key, (menu_entry, row)) in enumerate(exact.items()):
+                score = float(score_block([menu_entry], block.take([i]))[0, 0])
+                self._store_match(matches, entry_key, (row, score, 'exact'))
+
+        for key, entries in blocks.items():
+            for entry_key, (row, score) in zip(entries, self._match_partition(key, list(entries.values()))):
+                self._store_match(matches, entry_key, (row, score, None if row is None else 'fuzzy'))
+
+        logger.debug("%d entries: %d cached, %d exact, %d fuzzy",
+                     len(menu_entries), cached, len(exact), sum(map(len, blocks.values())))
+
+        results = []
+        for entry_key in entry_keys:
+            row, score, path = matches[entry_key]
+            match = None if row is None else self.db.iloc[row]
+            results.append((match, score, path) if return_path else (match, score))
+
+        return results
+
+    def _store_match(self, matches, entry_key, match):
+        matches[entry_key] = match
+        if self.cache is not None:
+            self.cache.put(self._cache_key(entry_key), match)
+
+    def _cache_key(self, entry_key):
+        # stores configured to retrieve differently may answer differently, and share the SQLite tier
+        config = f'{self.candidate_mode}:{self.candidate_limit}:{self.partition_depth}'
+        return f'{self.fingerprint}:{config}:{json.dumps(entry_key)}'
+
+    def retrieve_top_k(self, menu_entry, k=3):
+        """
+        Find the k best matching wines for a menu entry, best first.
+
+        Expensive text fields are skipped for candidates that can no longer beat the k-th best.
+
+        Args:
+            menu_entry: dict with keys like 'description', 'year', 'region', 'country', 'type'
+            k: number of matches returned, at least 1
+
+        Returns:
+            tuple: (matches, stats) - list of (wine_row, score), and a dict with the
+                   'candidates', 'scored' and 'pruned' candidate counts
         """
         if self.db is None:
             raise ValueError("Database not loaded. Call load() first.")
-            
-        best_score = 0
-        best_match = None
-        df = self.db.copy()
+        if k < 1:
+            raise ValueError(f"Invalid k: {k}, at least 1 match is returned")
+
+        menu_entry = normalize_entry(menu_entry)
+        key = self._blocking_key(menu_entry)
+        if key is None:
+            return [], {'candidates': 0, 'scored': 0, 'pruned': 0}
+
+        rows = self._candidate_rows(menu_entry, self.partition(*key))
+        df = self.db.iloc[rows]
+
+        positions, scores, pruned = top_k_block(menu_entry, CandidateBlock(df), k)
+        matches = [(df.iloc[position], float(score)) for position, score in zip(positions, scores)]
+        stats = {'candidates': len(df), 'scored': len(df) - pruned, 'pruned': pruned}
+        logger.debug("top %d of %s: %s", k, key, stats)
+
+        return matches, stats
+
+    def _blocking_key(self, menu_entry):
+        """
+        Partition key of an entry: (country, type), narrowed by its variety and then its year up to
+        partition_depth columns, as long as the store has wines under the narrower key.
+        """
         if 'country' in menu_entry and 'type' in menu_entry and (menu_entry['type'] == 'red' or menu_entry['type'] == 'white'):
-          country = menu_entry['country']
-          type = menu_entry['type']
+            key = (menu_entry['country'], menu_entry['type'])
+            for column in PARTITION_COLUMNS[2:self.partition_depth]:
+                value = menu_entry.get(column)
+                if column in self.partition_values:
+                    value = self.partition_values[column].get(value)
+                if value is None or key + (value,) not in self.partitions:
+                    break
+                key += (value,)
+            return key
+
+    def _exact_row(self, menu_entry):
+        """
+        Row position of the single wine matching the entry's normalized keys, within its partition if it has one.
+        """
+        year = menu_entry.get('year')
+        description = menu_entry.get('description')
+        winery = menu_entry.get('winery') or description
+        if year is None or not winery:
+            return None
+
+        lookups = [self.exact_index['description'].get((description, year))]
+        if menu_entry.get('variety'):
+            lookups.insert(0, self.exact_index['winery'].get((winery, menu_entry['variety'], year)))
+
+        # the (country, type) partition, a narrower one would drop description matches of another variety
+        key = self._blocking_key(menu_entry)
+        partition = None if key is None else self.partition(*key[:2])
+
+        for row in lookups:
+            if row is not None and (partition is None or partition.start <= row < partition.stop):
+                return row
 
-          df = df[(df["country"] == country) & (df["type"] == type)]
-          print(f"filter by country {country} and {type}, size {len(df)}/{len(self.db)}")
+    def _entry_key(self, menu_entry):
+        return tuple(sorted((k, repr(v)) for k, v in menu_entry.items()))
 
+    def _match_partition(self, key, menu_entries):
+        """
+        Best (row position, score) of each menu entry within one partition.
+        """
+        partition = self.partition(*key)
+        logger.debug("partition %s: %d/%d rows, %d entries", key, partition.stop - partition.start, len(self.db), len(menu_entries))
+
+        # only the wines sharing the most n-grams with the description get fully scored
+        candidates = [self._candidate_rows(menu_entry, partition) for menu_entry in menu_entries]
+        narrowed = [rows for rows in candidates if not isinstance(rows, slice)]
+
+        if len(narrowed) == len(candidates):
+            rows = np.unique(np.concatenate(narrowed))
         else:
-          return None, 0
-        
-        for i, wine in df.iterrows():
-            score = self._calculate_match_score(menu_entry, wine)
-            
-            if score > best_score:
-                best_score = score
-                best_match = wine
-        
-        return best_match, best_score
+            rows = np.arange(partition.start, partition.stop)
+
+        if len(rows) == 0:
+            return [(None, 0)] * len(menu_entries)
+
+        df = self.db.iloc[rows]
+        scores = score_block(menu_entries, CandidateBlock(df))
+
+        results = []
+        for entry_scores, entry_rows in zip(scores, candidates):
+            if not isinstance(entry_rows, slice):
+                entry_scores = np.where(np.isin(rows, entry_rows), entry_scores, 0.0)
+
+            best = int(entry_scores.argmax())
+            if entry_scores[best] > 0:
+                results.append((int(rows[best]), float(entry_scores[best])))
+            else:
+                results.append((None, 0))
+
+        return results
+
+    def _candidate_rows(self, menu_entry, partition):
+        """
+        Rows of a partition worth scoring for an entry: n-gram or ANN candidates for large partitions, else the whole slice.
+        """
+        if self.candidate_mode == 'exact' or partition.stop - partition.start <= self.candidate_limit:
+            return partition
+
+        if self.candidate_mode == 'ann':
+            rows = self.ann_index.query_entry(menu_entry, self.candidate_limit, partition)
+        elif menu_entry.get('description'):
+            rows = self.index.query(menu_entry['description'], self.candidate_limit, partition)
+        else:
+            rows = []
+
+        if len(rows) > 0:
+            return rows
+
+        return partition
 
     def _calculate_match_score(self, menu_entry, wine_row):
         """
         Calculate weighted similarity score between menu entry and wine.
+        Row-at-a-time reference for store.match_scorer.score_block.
         
         Returns:
             float: Score between 0 and 1
         """
+        menu_entry = normalize_entry(menu_entry)
         score = 0
         
         # Text similarity (heaviest weight)
-        if 'description' in menu_entry and 'description' in wine_row and pd.notna(wine_row['description']):
-            text_sim = fuzz.ratio(str(menu_entry['description']), str(wine_row['description'])) / 100
+        if 'description' in menu_entry and 'description_key' in wine_row and pd.notna(wine_row['description_key']):
+            text_sim = fuzz.ratio(str(menu_entry['description']), str(wine_row['description_key'])) / 100
             score += text_sim * 0.4
 
         # Text similarity (heaviest weight)
-        if 'description' in menu_entry and 'winery' in wine_row and pd.notna(wine_row['winery']):
-            text_sim = fuzz.ratio(str(menu_entry['description']), str(wine_row['winery'])) / 100
+        if 'description' in menu_entry and 'winery_key' in wine_row and pd.notna(wine_row['winery_key']):
+            text_sim = fuzz.ratio(str(menu_entry['description']), str(wine_row['winery_key'])) / 100
             score += text_sim * 0.3
         
         # Year match
@@ -76,23 +560,23 @@ class WineStore:
                 score += 0.1
         
         # Region match
-        if 'region' in menu_entry and 'region' in wine_row and pd.notna(wine_row['region']):
-            region_sim = fuzz.ratio(str(menu_entry['region']), str(wine_row['region'])) / 100
+        if 'region' in menu_entry and 'region_key' in wine_row and pd.notna(wine_row['region_key']):
+            region_sim = fuzz.ratio(str(menu_entry['region']), str(wine_row['region_key'])) / 100
             score += region_sim * 0.40
         
         # Country match
-        if 'country' in menu_entry and 'country' in wine_row and pd.notna(wine_row['country']):
-            country_sim = fuzz.ratio(str(menu_entry['country']), str(wine_row['country'])) / 100
+        if 'country' in menu_entry and 'country_key' in wine_row and pd.notna(wine_row['country_key']):
+            country_sim = fuzz.ratio(str(menu_entry['country']), str(wine_row['country_key'])) / 100
             score += country_sim * 0.20
         
         # Variety match
-        if 'variety' in menu_entry and 'variety' in wine_row and pd.notna(wine_row['variety']):
-            variety_sim = fuzz.ratio(str(menu_entry['variety']), str(wine_row['variety'])) / 100
+        if 'variety' in menu_entry and 'variety_key' in wine_row and pd.notna(wine_row['variety_key']):
+            variety_sim = fuzz.ratio(str(menu_entry['variety']), str(wine_row['variety_key'])) / 100
             score += variety_sim * 0.1
         
         # Variety match
-        if 'type' in menu_entry and 'type' in wine_row and pd.notna(wine_row['type']):
-            type_sim = fuzz.ratio(str(menu_entry['type']), str(wine_row['type'])) / 100
+        if 'type' in menu_entry and 'type_key' in wine_row and pd.notna(wine_row['type_key']):
+            type_sim = fuzz.ratio(str(menu_entry['type']), str(wine_row['type_key'])) / 100
             score += type_sim * 0.1
 
 
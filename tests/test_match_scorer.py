@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from store.match_keys import add_match_keys, normalize_entry
+from store.match_scorer import CandidateBlock, score_block, top_k_block
+from store.store_loader import WINE_DTYPES
+from store.wine_store import WineStore
+
+WINES = pd.DataFrame({
+    'description': ['Penfolds Grange Shiraz', 'Château Margaux', 'Cloudy Bay Sauvignon Blanc', None, 'Barolo Riserva'],
+    'winery': ['Penfolds', 'Château Margaux', 'Cloudy Bay', 'Unknown', None],
+    'year': [2018, 2015, None, 2020, 2016],
+    'region': ['Barossa Valley', 'Margaux', 'Marlborough', None, 'Piedmont'],
+    'country': ['aus', 'fra', 'nzl', 'usa', 'ita'],
+    'variety': ['Syrah', 'Bordeaux', 'Sauvignon Blanc', 'Merlot', None],
+    'type': ['red', 'red', 'white', 'red', 'red'],
+    'rank': [0.98, 0.97, 0.9, 0.8, 0.92],
+    'price': [900.0, 800.0, 30.0, None, 60.0],
+})
+
+MENU_ENTRIES = [
+    {'description': 'Penfolds Grange', 'year': 2018, 'region': 'Barossa', 'country': 'aus', 'type': 'red'},
+    {'description': 'Chateau Margaux', 'year': 2016, 'country': 'fra', 'variety': 'bordeaux', 'type': 'red'},
+    {'description': 'cloudy bay sauv blanc', 'year': 2014, 'type': 'white'},
+    {'description': 'Barolo', 'region': 'Piemonte', 'variety': 'Nebbiolo'},
+    {'description': ''},
+    {'year': 2020, 'country': 'usa'},
+]
+
+
+@pytest.fixture(scope='module')
+def wines():
+    return add_match_keys(WINES.astype({column: dtype for column, dtype in WINE_DTYPES.items() if column in WINES.columns}))
+
+
+def test_score_block_matches_row_wise_reference(wines):
+    store = WineStore('unused.csv')
+    expected = np.array([[store._calculate_match_score(entry, row) for _, row in wines.iterrows()]
+                         for entry in MENU_ENTRIES])
+
+    scores = score_block([normalize_entry(entry) for entry in MENU_ENTRIES], CandidateBlock(wines))
+
+    assert scores.shape == (len(MENU_ENTRIES), len(wines))
+    np.testing.assert_allclose(scores, expected, rtol=0, atol=1e-9)
+
+
+def test_taken_block_scores_like_its_rows(wines):
+    block = CandidateBlock(wines)
+    entries = [normalize_entry(entry) for entry in MENU_ENTRIES]
+
+    np.testing.assert_allclose(score_block(entries, block.take([4, 0])), score_block(entries, block)[:, [4, 0]])
+
+
+@pytest.mark.parametrize('k', [1, 2, 5, 12, 100])
+def test_top_k_block_keeps_the_best_scores(k):
+    # descriptions and years varied so the pruning bound and the chunks have something to cut
+    many = pd.concat([WINES] * 8, ignore_index=True)
+    many['description'] = [f'{description} {i}' if description else None for i, description in enumerate(many['description'])]
+    many['year'] += np.arange(len(many)) % 3
+    block = CandidateBlock(add_match_keys(many.astype({column: dtype for column, dtype in WINE_DTYPES.items() if column in many.columns})))
+
+    for entry in map(normalize_entry, MENU_ENTRIES):
+        scores = np.sort(score_block([entry], block)[0])[::-1]
+        positions, top, _ = top_k_block(entry, block, k, chunk_size=2)
+
+        np.testing.assert_allclose(top, scores[scores > 0][:k], rtol=0, atol=1e-9)
+        np.testing.assert_allclose(score_block([entry], block.take(positions))[0], top, rtol=0, atol=1e-9)
+
+
+def test_retrieve_top_k_rejects_k_below_one():
+    store = WineStore('unused.csv')
+    store.db = pd.DataFrame()
+
+    with pytest.raises(ValueError):
+        store.retrieve_top_k({'description': 'Penfolds Grange', 'country': 'aus', 'type': 'red'}, k=0)
@@ -0,0 +1,47 @@
+import pytest
+
+from scanner.menu_token_enrichor import MenuTokenEnrichor
+
+
+@pytest.fixture(scope='module')
+def enrichor():
+    return MenuTokenEnrichor()
+
+
+@pytest.mark.parametrize('text, flag, expected, distance', [
+    ('Shlraz', 'is_varietal_red', 'syrah', 1),
+    ('Chardonay', 'is_varietal_white', 'chardonnay', 1),
+    ('Marlborougn', 'is_region', 'marlborough', 1),
+])
+def test_misread_terms_are_corrected(enrichor, text, flag, expected, distance):
+    token = enrichor.enrich_token({'text': text})
+    assert token[flag]
+    assert token['text'] == text.lower()
+    assert token['term'] == expected
+    assert token['edit_distance'] == distance
+
+
+def test_confident_tokens_are_not_corrected(enrichor):
+    token = enrichor.enrich_token({'text': 'Shlraz', 'confidence': 0.95})
+    assert token == {'text': 'Shlraz', 'confidence': 0.95}
+    assert enrichor.enrich_token({'text': 'Shlraz', 'confidence': 0.4})['term'] == 'syrah'
+
+
+@pytest.mark.parametrize('text', ['creek', 'Creek', 'port', 'heritage', 'Jacob\'s', 'estate', 'zim',
+                                  'Grange', 'Bollinger', 'Corton'])
+def test_ordinary_words_are_not_corrected(enrichor, text):
+    token = enrichor.enrich_token({'text': text})
+    assert not any(key.startswith('is_') for key in token)
+    assert 'edit_distance' not in token
+    assert 'term' not in token
+
+
+def test_exact_terms_have_no_edit_distance(enrichor):
+    token = enrichor.enrich_token({'text': 'Merlot'})
+    assert token['is_varietal_red']
+    assert 'edit_distance' not in token
+
+
+def test_fuzzy_lookup_can_be_disabled():
+    token = MenuTokenEnrichor(fuzzy_distance=0).enrich_token({'text': 'Shlraz'})
+    assert token == {'text': 'Shlraz'}
@@ -0,0 +1,80 @@
+import pandas as pd
+
+from store.store_dedupe import dedupe_store
+from store.store_loader import WINE_DTYPES
+
+
+def store_frame(rows):
+    df = pd.DataFrame([{'winery': 'Penfolds', 'year': 2018, 'country': 'aus', 'type': 'red', 'variety': 'Syrah',
+                        'rank': 0.9, **row} for row in rows])
+    df = df.astype({column: dtype for column, dtype in WINE_DTYPES.items() if column in df.columns})
+    df['source'] = pd.Categorical(df['source'])
+    return df
+
+
+def test_same_wine_across_sources_is_merged():
+    df = store_frame([
+        {'description': 'Penfolds Grange Shiraz', 'price': 900.0, 'source': 'vivino'},
+        {'description': 'Penfolds 2018 Grange Shiraz', 'price': 850.0, 'source': 'winemag'},
+    ])
+
+    deduped, report = dedupe_store(df)
+
+    assert len(deduped) == 1
+    assert deduped.loc[0, 'records'] == 2
+    assert deduped.loc[0, 'price_vivino'] == 900.0
+    assert deduped.loc[0, 'price_winemag'] == 850.0
+    assert report['reduction'] == 0.5
+
+
+def test_cuvee_numbers_must_match():
+    df = store_frame([
+        {'description': 'Penfolds Bin 128 Shiraz', 'price': 45.0, 'source': 'vivino'},
+        {'description': 'Penfolds Bin 138 Shiraz', 'price': 50.0, 'source': 'winemag'},
+    ])
+
+    deduped, _ = dedupe_store(df)
+
+    assert list(deduped['description']) == ['Penfolds Bin 128 Shiraz', 'Penfolds Bin 138 Shiraz']
+    assert list(deduped['records']) == [1, 1]
+
+
+def test_subset_descriptions_are_distinct_wines():
+    df = store_frame([
+        {'description': 'Penfolds Grange Shiraz', 'price': 900.0, 'source': 'vivino'},
+        {'description': 'Penfolds Bin 28 Kalimna Shiraz', 'price': 40.0, 'source': 'winemag'},
+        {'description': 'Penfolds Bin 128 Coonawarra Shiraz', 'price': 45.0, 'source': 'vivino'},
+        {'description': 'Penfolds Shiraz', 'price': 20.0, 'source': 'winemag'},
+    ])
+
+    deduped, report = dedupe_store(df)
+
+    assert len(deduped) == 4
+    assert report['reduction'] == 0
+    assert deduped.loc[deduped['description'] == 'Penfolds Grange Shiraz', 'price'].item() == 900.0
+
+
+def test_chained_rows_are_compared_with_the_canonical_record():
+    # each description is similar to the next one, the first and the last are not
+    df = store_frame([
+        {'description': 'shiraz reserve aaaaaaaa', 'price': 10.0, 'source': 'vivino'},
+        {'description': 'shiraz reserve aaaaaabb', 'price': None, 'source': 'winemag'},
+        {'description': 'shiraz reserve aaaabbbb', 'price': None, 'source': 'winemag'},
+    ])
+
+    deduped, report = dedupe_store(df)
+
+    assert list(deduped['description']) == ['shiraz reserve aaaaaaaa', 'shiraz reserve aaaabbbb']
+    assert list(deduped['records']) == [2, 1]
+    assert report['unchained_rows'] == 1
+
+
+def test_rows_missing_a_blocking_column_are_kept():
+    df = store_frame([
+        {'description': 'Penfolds Grange Shiraz', 'price': 900.0, 'source': 'vivino', 'variety': None},
+        {'description': 'Penfolds Grange Shiraz', 'price': 900.0, 'source': 'winemag', 'variety': None},
+    ])
+
+    deduped, _ = dedupe_store(df)
+
+    assert len(deduped) == 2
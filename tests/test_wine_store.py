@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from store.wine_store import WineStore
+
+
+def store_csv(path):
+    rows = [
+        ('Penfolds', 'Penfolds Bin 128 Shiraz', 'Syrah', 2018),
+        ('Penfolds', 'Penfolds Bin 28 Kalimna', 'Syrah', 2019),
+        ('Henschke', 'Henschke Cyril Henschke', 'Cabernet Sauvignon', 2018),
+    ]
+    df = pd.DataFrame([{'country': 'aus', 'region': 'barossa', 'year': year, 'rank': 4.0, 'winery': winery,
+                        'description': description, 'type': 'red', 'variety': variety, 'price': 50.0}
+                       for winery, description, variety, year in rows])
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+@pytest.mark.parametrize('depth, entry, key', [
+    (2, {'variety': 'syrah', 'year': 2018}, ('aus', 'red')),
+    (3, {'variety': 'syrah', 'year': 2018}, ('aus', 'red', 'Syrah')),
+    (4, {'variety': 'syrah', 'year': 2018}, ('aus', 'red', 'Syrah', 2018)),
+    (4, {'variety': 'syrah', 'year': 2020}, ('aus', 'red', 'Syrah')),
+    (4, {'year': 2018}, ('aus', 'red')),
+    (4, {'variety': 'merlot', 'year': 2018}, ('aus', 'red')),
+])
+def test_blocking_key_narrows_to_partition_depth(tmp_path, depth, entry, key):
+    store = WineStore(store_csv(tmp_path / 'store.csv'), partition_depth=depth, candidate_mode='exact')
+    store.load()
+
+    assert store._blocking_key({'country': 'aus', 'type': 'red', **entry}) == key
+    assert store.partition(*key).stop > store.partition(*key).start
+
+
+def test_retrieve_top_k_stays_in_narrowed_partition(tmp_path):
+    store = WineStore(store_csv(tmp_path / 'store.csv'), partition_depth=4, candidate_mode='exact')
+    store.load()
+
+    matches, stats = store.retrieve_top_k({'description': 'Penfolds Shiraz', 'country': 'aus', 'type': 'red',
+                                           'variety': 'Syrah', 'year': 2018}, k=3)
+
+    assert stats['candidates'] == 1
+    assert matches[0][0]['description'] == 'Penfolds Bin 128 Shiraz'
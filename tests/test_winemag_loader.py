@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+
+from store.store_loader import extract_year
+from store.winemag_loader import benchmark, combine_description, combine_descriptions, extract_years
+
+# title, designation
+ROWS = [
+    ('Penfolds 2018 Grange Shiraz (South Australia)', 'Grange'),            # designation in the title
+    ('Grange', 'Penfolds 2018 Grange Shiraz Bin 95'),                      # title in the designation
+    ('Domaine Leflaive 2017 Puligny-Montrachet', 'Les Pucelles'),          # neither, both joined
+    (None, 'Reserve 2015'),                                                # missing title
+    ('Cloudy Bay 2021 Sauvignon Blanc (Marlborough)', None),               # missing designation
+    (None, None),                                                          # both missing
+    ('Quinta do Noval 1963 Vintage Port', 'Quinta do Noval 1963 Vintage Port'),
+    ('No vintage here', 'Brut'),
+]
+
+
+@pytest.fixture
+def reviews():
+    return pd.DataFrame(ROWS, columns=['title', 'description'])
+
+
+def test_combine_descriptions_matches_row_wise_reference(reviews):
+    expected = reviews.apply(combine_description, axis=1).astype('string')
+
+    combined = combine_descriptions(reviews['title'], reviews['description'])
+
+    pd.testing.assert_series_equal(combined, expected, check_names=False)
+    assert combined[0] == ROWS[0][0]
+    assert combined[1] == ROWS[1][1]
+    assert combined[2] == f'{ROWS[2][0]} {ROWS[2][1]}'
+    assert pd.isna(combined[5])
+
+
+def test_extract_years_matches_row_wise_reference(reviews):
+    description = combine_descriptions(reviews['title'], reviews['description'])
+    expected = description.apply(lambda text: extract_year(text) if pd.notna(text) else None).astype('Int16')
+
+    pd.testing.assert_series_equal(extract_years(description), expected, check_names=False)
+    assert list(extract_years(description)[:4]) == [2018, 2018, 2017, 2015]
+
+
+def test_benchmark_reports_parity(reviews):
+    report = benchmark(reviews, repeat=1)
+    assert report['description_parity'] and report['year_parity']